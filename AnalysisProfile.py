@@ -0,0 +1,121 @@
+from collections import deque
+import numpy as np
+
+from BreathingRateCounter import WindowCache, demodulations, estimators, fsB
+
+
+class AnalysisProfile:
+    """ Named set of analysis parameters that can be switched during a registration
+
+        bands      - (lhf, hhf, lbf, hbf) heart and breath frequency bands, Hz
+        window     - calculation window, s
+        hop        - time between calculations, s (windows overlap when hop < window)
+        estimator  - 'peaks' or 'spectrum', see breath_rate_counter
+        decimation - decimation of the filtered signals sent to the plots
+        demodulation - 'arc' (one phase signal of the arc demodulator) or 'quadrature' (both channels)
+
+        A profile is never modified, replace() returns a new one. The worker gets the
+        profile object with every interval, so an interval is processed entirely with
+        one profile and switching is a single reference assignment.
+    """
+    __slots__ = ('name', 'bands', 'window', 'hop', 'estimator', 'decimation', 'demodulation', 'caches')
+
+    def __init__(self, name, bands, window=60, hop=None, estimator='peaks', decimation=5, demodulation='quadrature'):
+        if estimator not in estimators:
+            raise ValueError("Unknown estimator: " + str(estimator))
+        if demodulation not in demodulations:
+            raise ValueError("Unknown demodulation: " + str(demodulation))
+        self.name = name
+        self.bands = tuple(float(value) for value in bands)
+        self.window = int(window)
+        self.hop = min(int(hop), self.window) if hop else self.window
+        self.estimator = estimator
+        self.decimation = max(int(decimation), 1)
+        self.demodulation = demodulation
+        self.caches = {}
+
+    def replace(self, **changes):
+        """ Returns a profile with the given parameters changed, or this one if nothing changes """
+        parameters = {'name': self.name, 'bands': self.bands, 'window': self.window, 'hop': self.hop,
+                      'estimator': self.estimator, 'decimation': self.decimation,
+                      'demodulation': self.demodulation}
+        parameters.update(changes)
+        if changes.get('window') and 'hop' not in changes and self.hop == self.window:
+            parameters['hop'] = changes['window']  # non-overlapping windows stay non-overlapping
+        profile = AnalysisProfile(**parameters)
+        return self if profile == self else profile
+
+    def __eq__(self, other):
+        return isinstance(other, AnalysisProfile) and \
+            (self.name, self.bands, self.window, self.hop, self.estimator, self.decimation, self.demodulation) == \
+            (other.name, other.bands, other.window, other.hop, other.estimator, other.decimation, other.demodulation)
+
+    def __hash__(self):
+        return hash((self.name, self.bands, self.window, self.hop, self.estimator, self.decimation,
+                     self.demodulation))
+
+    def samples(self):
+        return self.window * fsB
+
+    def cache(self, precision='float64'):
+        """ WindowCache of this profile for the precision, built on the first request """
+        cache = self.caches.get(precision)
+        if cache is None:
+            cache = self.caches[precision] = WindowCache(self.samples(), self.bands, np.dtype(precision))
+        return cache
+
+    def prepare(self, precision='float64'):
+        """ Precomputes the caches before the profile is applied, so the worker does not have to """
+        self.cache(precision)
+        return self
+
+
+class SlidingWindow:
+    """ Keeps the last historyMs of the stream and cuts calculation windows of windowMs from it
+
+        Intervals arrive every hop, so windows overlap when the hop is shorter than
+        the window. The history is longer than any window, so a longer window can be
+        served right after it is set without waiting for new samples.
+    """
+
+    def __init__(self, windowMs, historyMs=300000, dt_ms=20):
+        self.windowMs = windowMs
+        self.historyMs = max(historyMs, windowMs)
+        self.dt_ms = dt_ms
+        self.reset()
+
+    def reset(self):
+        self.chunks = deque()
+        self.startT = None
+
+    def setLength(self, windowMs):
+        self.windowMs = windowMs
+        self.historyMs = max(self.historyMs, windowMs)
+
+    def append(self, a_ch0, a_ch1, T_meas):
+        """ Adds an interval, returns the window (a_ch0, a_ch1, T_meas) ending with it or None while it is shorter """
+        if len(T_meas) == 0:
+            return None
+        if self.startT is None:
+            self.startT = int(T_meas[0]) - self.dt_ms
+        self.chunks.append((a_ch0, a_ch1, T_meas))
+        T_end = int(T_meas[-1])
+        while int(self.chunks[0][2][-1]) <= T_end - self.historyMs:
+            self.chunks.popleft()
+        if T_end - self.startT < self.windowMs:
+            return None
+
+        T_begin = T_end - self.windowMs
+        selected = [chunk for chunk in self.chunks if int(chunk[2][-1]) > T_begin]
+        a_ch0, a_ch1, T_meas = (np.concatenate(parts) for parts in zip(*selected))
+        begin = int(np.searchsorted(T_meas, T_begin, side='right'))
+        return a_ch0[begin:], a_ch1[begin:], T_meas[begin:]
+
+
+profiles = {profile.name: profile for profile in (
+    AnalysisProfile('adult', (0.7, 2.5, 0.01, 0.4), window=60),
+    AnalysisProfile('infant', (1.5, 3.3, 0.3, 1.0), window=30, hop=10),
+    AnalysisProfile('sleep', (0.6, 1.8, 0.05, 0.4), window=120, hop=60, estimator='spectrum', decimation=10),
+    AnalysisProfile('exercise', (1.2, 3.3, 0.2, 0.9), window=20, hop=5, estimator='spectrum', decimation=2),
+)}
+defaultProfile = profiles['adult']
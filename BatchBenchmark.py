@@ -0,0 +1,50 @@
+import sys
+import time
+import numpy as np
+
+from BreathingRateCounter import breath_rate_counter, breath_rate_counter_batch, sliding_windows, fsB
+
+
+def synthetic_recording(minutes=60, seed=0):
+    """ I/Q pair of a radar looking at a breathing subject with a slowly changing rate """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(minutes * 60 * fsB)) / fsB
+    phase = 0.6 * np.sin(2 * np.pi * (0.25 * t + 0.0005 * t ** 2 / 60)) + \
+        0.15 * np.sin(2 * np.pi * 1.2 * t) + 0.05 * rng.normal(size=len(t))
+    a_ch0 = np.rint(2000 + 400 * np.cos(phase + 0.5)).astype(np.uint16)
+    a_ch1 = np.rint(2000 + 400 * np.sin(phase + 0.5)).astype(np.uint16)
+    return a_ch0, a_ch1
+
+
+def benchmark(a_ch0, a_ch1, t_interval=60, hop=10, settings=(0.7, 2.5, 0.01, 0.4)):
+    """ Times the looped and the batch processing of all windows of a recording """
+    windows = sliding_windows(np.asarray(a_ch0) / 8000, np.asarray(a_ch1) / 8000,
+                              t_interval * fsB, hop * fsB)
+
+    start = time.perf_counter()
+    # the batch path processes whole windows, so does the loop it is compared with
+    looped = [breath_rate_counter(window[:, 0], window[:, 1], t_interval, *settings, artifacts=False)
+              for window in windows]
+    loopTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    hr, br, peaks = breath_rate_counter_batch(windows, t_interval, *settings)
+    batchTime = time.perf_counter() - start
+
+    mismatches = np.count_nonzero((np.abs(hr - [r[0] for r in looped]) > 1e-9) |
+                                  (np.abs(br - [r[1] for r in looped]) > 1e-9))
+    return {'windows': len(windows), 'loop': loopTime, 'batch': batchTime, 'mismatches': mismatches}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        recordings = [(fileName, np.load(fileName)) for fileName in sys.argv[1:]]
+        recordings = [(name, (rad["ch0"], rad["ch1"])) for name, rad in recordings]
+    else:
+        recordings = [('synthetic, 60 min', synthetic_recording())]
+
+    for name, (a_ch0, a_ch1) in recordings:
+        result = benchmark(a_ch0, a_ch1)
+        print("%s: %d windows, loop %.2f s, batch %.2f s, speedup %.1f, mismatches %d" %
+              (name, result['windows'], result['loop'], result['batch'],
+               result['loop'] / result['batch'], result['mismatches']))
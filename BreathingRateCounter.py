@@ -1,14 +1,28 @@
 from scipy import signal
-from numpy.fft import rfft, rfftfreq, fft
+from scipy.fft import fft, rfft
 import numpy as np
-from scipy.signal import butter, find_peaks
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import butter
+from scipy import ndimage
+from time import perf_counter
+from functools import lru_cache
 
 """" Объявляем константы """
 fsB = 50  # частота дисретизации БРЛ
+# полосы по умолчанию для функций, вызванных без полос; breath_rate_counter их не меняет,
+# полосы передаются явно, поэтому обработка в разных потоках не мешает друг другу
 lowFreqHearthGlobal = 0.7
 highFreqHearthGlobal = 2.5
 lowFreqBreathGlobal = 0.01
 highFreqBreathGlobal = 0.4
+fftWorkers = -1  # число потоков для scipy.fft (-1 - все ядра)
+peakProminence = 0.5  # минимальная проминентность пика в долях огибающей сигнала
+estimators = ('peaks', 'spectrum')  # способы оценки ЧСС и ЧД: по числу пиков или по пику спектра
+demodulations = ('arc', 'quadrature')  # обработка фазы после дуговой демодуляции или двух квадратур
+artifactDerivative = 8.0  # порог приращения сигнала в скользящих СКО приращения
+artifactAmplitude = 6.0  # порог отклонения от скользящего среднего в СКО окна
+artifactFloor = 0.001  # нижняя граница СКО, чтобы шум пустой сцены не считался артефактом
+minSegment = 10  # минимальная длина чистого участка, с
 
 
 def butter_bandpass(lowcut, highcut, fs, order=5):
@@ -19,110 +33,529 @@ def butter_bandpass(lowcut, highcut, fs, order=5):
     return b, a
 
 
-def fourier_analysis(signal1, signal2, fs, freq_low, freq_high):
-    sum_signal = []
-    for i in range(0, min(len(signal1), len(signal2))):  # собираем общий сигнал из двух квадратур
-        sum_signal.append(complex(signal1[i], signal2[i]))
+def butter_bandpass_sos(lowcut, highcut, fs, order=5, dtype=np.float64):
+    nyq = 0.5 * fs
+    sos = butter(order, [lowcut / nyq, highcut / nyq], btype='band', output='sos')
+    return sos.astype(dtype)  # коэффициенты в той же точности, что и сигнал
 
-    fsignal = fft(sum_signal)  # используем преобразование Фурье
-    fsignal = np.abs(fsignal)  # только положительную часть спектра
-    time_step = 1 / fs
-    freqs = np.fft.fftfreq(len(sum_signal), time_step)  # находим частоты составляющих спектра
-    freqs = np.abs(freqs)
-    freq_low = min(freqs, key=lambda x: abs(x - freq_low))  # находим в массиве частот ближайшие
-    freq_high = min(freqs, key=lambda x: abs(x - freq_high))  # к частотам среза
-    freq_low_ind = np.where(freqs == freq_low)[0][0]
-    freq_high_ind = np.where(freqs == freq_high)[0][0]
-    fsignal_max = max(fsignal[freq_low_ind:freq_high_ind])  # находим максимальную составляющую частоты
-    freq_max_ind = np.where(fsignal == fsignal_max)
-    freq_max = freqs[freq_max_ind]
-    return freq_max[0]
 
+def band_indices(freqs, freq_low, freq_high):
+    freq_low_ind = int(np.argmin(np.abs(freqs - freq_low)))  # находим в массиве частот ближайшие
+    freq_high_ind = int(np.argmin(np.abs(freqs - freq_high)))  # к частотам среза
+    return freq_low_ind, max(freq_high_ind, freq_low_ind + 1)
 
-def breath_filter(signal1, signal2):
+
+class SpectralPlan:
+    """
+    План спектрального анализа окна из n отсчётов в полосе [freq_low, freq_high]:
+    индексы границ полосы, частоты её бинов, оконная функция и число потоков scipy.fft.
+    Спектральный шаг - одно БПФ суммарного сигнала и argmax по срезу полосы.
+    """
+
+    def __init__(self, n, fs, freq_low, freq_high, window=None):
+        self.n = n
+        self.fs = fs
+        self.freq_low = freq_low
+        self.freq_high = freq_high
+        self.resolution = fs / n  # шаг спектра
+        freqs = np.abs(np.fft.fftfreq(n, 1 / fs))
+        self.low, self.high = band_indices(freqs, freq_low, freq_high)
+        self.freqs = freqs[self.low:self.high]  # частоты бинов полосы
+        self.window = signal.get_window(window, n) if window is not None else None
+        self.workers = fftWorkers
+
+    def magnitudes(self, signal1, signal2=None):
+        """
+        Амплитуды спектра сигнала signal1 + j * signal2 в полосе (по последней оси).
+        Без signal2 - спектр вещественного signal1 (фазы), достаточно rfft: бины полосы те же.
+        """
+        signal1 = np.asarray(signal1)
+        if signal2 is None:
+            real_signal = signal1[..., :self.n]
+            if self.window is not None:
+                real_signal = real_signal * self.window
+            return np.abs(rfft(real_signal, axis=-1, workers=self.workers)[..., self.low:self.high])
+        signal2 = np.asarray(signal2)
+        sum_signal = np.empty(signal1.shape[:-1] + (self.n,), dtype=np.result_type(signal1, signal2, np.complex64))
+        sum_signal.real = signal1[..., :self.n]  # собираем общий сигнал из двух квадратур
+        sum_signal.imag = signal2[..., :self.n]
+        if self.window is not None:
+            sum_signal *= self.window
+        fsignal = fft(sum_signal, axis=-1, workers=self.workers)
+        return np.abs(fsignal[..., self.low:self.high])  # модуль только в полосе
+
+    def bin(self, freq):
+        """ Индекс ближайшего к freq бина в срезе полосы """
+        return int(np.ceil(freq / self.resolution - 0.5)) - self.low
+
+    def peak(self, magnitudes, freq_low=None, freq_high=None):
+        """ Частота и амплитуда максимума в полосе или в её части [freq_low, freq_high] """
+        low, high = 0, len(self.freqs)
+        if freq_low is not None:
+            low = min(max(self.bin(freq_low), 0), high - 1)
+            high = min(max(self.bin(freq_high), low + 1), high)
+        freq_max_ind = low + int(np.argmax(magnitudes[low:high]))
+        return self.freqs[freq_max_ind], magnitudes[freq_max_ind]
+
+    def batch_peak(self, magnitudes):
+        """ Частоты максимумов в полосе для каждой строки magnitudes """
+        return self.freqs[np.argmax(magnitudes, axis=-1)]
+
+
+@lru_cache(maxsize=64)
+def spectral_plan(n, fs, freq_low, freq_high, window=None):
+    """ План для окна и полосы, создаётся один раз на сочетание параметров """
+    return SpectralPlan(n, fs, freq_low, freq_high, window)
+
+
+def fourier_analysis(signal1, signal2, fs, freq_low, freq_high, tracker=None, cache=None):
+    n = len(signal1) if signal2 is None else min(len(signal1), len(signal2))
+    plan = cache.plan(freq_low, freq_high) if cache is not None else None
+    if plan is None or plan.n != n:
+        plan = spectral_plan(n, fs, freq_low, freq_high)
+    magnitudes = plan.magnitudes(signal1, signal2)
+    if tracker is not None:
+        return tracker.track(plan, magnitudes)
+    return plan.peak(magnitudes)[0]
+
+
+class WindowCache:
+    """
+    Не зависящие от сигнала данные для окна из n отсчётов и полос (lhf, hhf, lbf, hbf):
+    спектральные планы полос сердца и дыхания и фильтр широкой полосы сердца.
+    Вычисляются один раз при выборе профиля анализа, а не в каждом окне.
+    """
+
+    def __init__(self, n, bands, dtype=np.float64):
+        self.n = n
+        self.bands = tuple(bands)
+        self.dtype = np.dtype(dtype)
+        lhf, hhf, lbf, hbf = self.bands
+        self.plans = {(lhf, hhf): spectral_plan(n, fsB, lhf, hhf),
+                      (lbf, hbf): spectral_plan(n, fsB, lbf, hbf)}
+        self.heart_sos = butter_bandpass_sos(lhf, hhf, fsB, order=2, dtype=self.dtype)
+
+    def plan(self, freq_low, freq_high):
+        return self.plans.get((freq_low, freq_high))
+
+    def matches(self, n, bands, dtype):
+        return n == self.n and tuple(bands) == self.bands and np.dtype(dtype) == self.dtype
+
+
+class FrequencyTracker:
+    """
+    Альфа-бета фильтр доминирующей частоты между соседними окнами.
+    Максимум ищется только в окрестности прогноза, при низкой уверенности
+    (отношение пика к среднему уровню спектра в полосе) - по всей полосе.
+    """
+
+    def __init__(self, searchWidth, alpha=0.5, beta=0.1, minConfidence=3.0):
+        self.searchWidth = searchWidth  # полуширина окрестности поиска, Гц
+        self.alpha = alpha
+        self.beta = beta
+        self.minConfidence = minConfidence
+        self.reset()
+
+    def reset(self, freq=None):
+        self.freq = freq
+        self.rate = 0  # изменение частоты за окно
+        self.fullSearches = 0
+        self.narrowSearches = 0
+
+    def track(self, plan, magnitudes):
+        """ plan - SpectralPlan полосы, magnitudes - амплитуды спектра в ней """
+        band_level = np.mean(magnitudes)
+
+        if self.freq is not None:
+            predicted = self.freq + self.rate
+            width = max(self.searchWidth, 3 * plan.resolution)  # не уже трёх бинов спектра
+            low = max(plan.freq_low, predicted - width)
+            high = min(plan.freq_high, predicted + width)
+            if high > low:
+                freq, magnitude = plan.peak(magnitudes, low, high)
+                if magnitude >= self.minConfidence * band_level:
+                    self.narrowSearches += 1
+                    residual = freq - predicted
+                    self.freq = predicted + self.alpha * residual
+                    self.rate += self.beta * residual
+                    return self.freq
+
+        # первое окно или потеря уверенности - поиск по всей полосе
+        freq, magnitude = plan.peak(magnitudes)
+        fullSearches = self.fullSearches
+        self.reset(freq)
+        self.fullSearches = fullSearches + 1
+        return freq
+
+
+class ArcDemodulator:
+    """
+    Дуговая демодуляция квадратур: центр дуги I/Q - подгонка окружности по методу Каса
+    с забыванием за memory секунд, сигнал - длина дуги, пока подгонка не обусловлена - проекция на главную ось.
+    """
+
+    def __init__(self, memory=30, minArc=0.05, minRadius=1.0, maxResidual=0.25, fs=fsB):
+        self.memory = memory
+        self.minArc = minArc
+        self.minRadius = minRadius
+        self.maxResidual = maxResidual
+        self.fs = fs
+        self.reset()
+
+    def reset(self):
+        self.origin = None
+        self.moments = np.zeros((4, 4))
+        self.fit = None  # (xc, yc, радиус), заменяется целиком - читается из другого потока
+        self.axis = None  # (среднее x, среднее y, направление главной оси)
+
+    def update(self, i, q):
+        """ Добавляет блок отсчётов квадратур и уточняет центр дуги """
+        i = np.asarray(i, dtype=np.float64)
+        q = np.asarray(q, dtype=np.float64)
+        if len(i) == 0:
+            return self.fit
+        if self.origin is None:
+            self.origin = (float(np.mean(i)), float(np.mean(q)))  # для обусловленности моментов
+        x = i - self.origin[0]
+        y = q - self.origin[1]
+        terms = np.stack((x, y, np.ones_like(x), x * x + y * y))
+        self.moments = self.moments * np.exp(-len(x) / (self.memory * self.fs)) + terms @ terms.T
+
+        count = self.moments[2, 2]
+        mean = self.moments[:2, 2] / count
+        covariance = self.moments[:2, :2] / count - np.outer(mean, mean)
+        variances, vectors = np.linalg.eigh(covariance)
+        self.axis = (mean[0] + self.origin[0], mean[1] + self.origin[1], vectors[:, -1])
+
+        try:
+            solution = np.linalg.solve(self.moments[:3, :3], self.moments[:3, 3])
+        except np.linalg.LinAlgError:
+            return self.fit
+        xc, yc = solution[:2] / 2
+        radius = np.sqrt(max(solution[2] + xc * xc + yc * yc, 0.0))
+        spread = np.sqrt(max(np.trace(covariance), 0.0))
+        # алгебраическая невязка x^2 + y^2 - 2 xc x - 2 yc y - c близка к 2 r * (расстояние до окружности)
+        residual = max(self.moments[3, 3] - solution @ self.moments[:3, 3], 0.0) / count
+        # дуга достаточно длинная, радиус не меньше разброса облака, окружность точнее прямой
+        conditioned = radius > 0 and spread >= self.minArc * radius and \
+            radius > self.minRadius * np.sqrt(max(variances[-1], 0.0)) and \
+            residual / (4 * radius * radius) < self.maxResidual * max(variances[0], 0.0)
+        self.fit = (xc + self.origin[0], yc + self.origin[1], radius) if conditioned else None
+        return self.fit
+
+    def demodulate(self, i, q):
+        """ Длина дуги отсчётов от направления на центр, развёрнутая без скачков на 2 pi """
+        i = np.asarray(i, dtype=np.float64)
+        q = np.asarray(q, dtype=np.float64)
+        fit = self.fit
+        if fit is None:
+            axis = self.axis
+            if axis is None:
+                return i - np.mean(i)
+            return (i - axis[0]) * axis[2][0] + (q - axis[1]) * axis[2][1]
+        xc, yc, radius = fit
+        return radius * np.unwrap(np.arctan2(q - yc, i - xc))
+
+
+def create_trackers():
+    """ Трекеры частоты дыхания и сердцебиения для последовательных окон """
+    return FrequencyTracker(0.05), FrequencyTracker(0.15)
+
+
+def breath_filter(signal1, signal2, tracker=None, cache=None, band=None):
+    """
+    signal2 = None - одноканальная обработка фазы, второй отфильтрованный сигнал тоже None
+    band - полоса дыхания (lbf, hbf), по умолчанию глобальная
+    """
     order = 2
-    global lowFreqBreathGlobal
-    global highFreqBreathGlobal
+    freq_low, freq_high = band if band is not None else (lowFreqBreathGlobal, highFreqBreathGlobal)
 
-    freq_sum = fourier_analysis(signal1, signal2, fsB, lowFreqBreathGlobal, highFreqBreathGlobal)
+    freq_sum = fourier_analysis(signal1, signal2, fsB, freq_low, freq_high, tracker, cache)
     low_freq_breath = freq_sum - 0.1
     high_freq_breath = freq_sum + 0.1
     if (freq_sum - 0.1) <= 0:
         low_freq_breath = 0.01
 
-    B_br, A_br = butter_bandpass(low_freq_breath, high_freq_breath, fsB, order=order)
+    sos_br = butter_bandpass_sos(low_freq_breath, high_freq_breath, fsB, order=order, dtype=signal1.dtype)
 
-    signalfilt_r1_1 = signal.filtfilt(B_br, A_br, signal1)
-    signalfilt_r1_2 = signal.filtfilt(B_br, A_br, signal2)
-    return signalfilt_r1_1, signalfilt_r1_2
+    signalfilt_r1_1 = signal.sosfiltfilt(sos_br, signal1)
+    signalfilt_r1_2 = None if signal2 is None else signal.sosfiltfilt(sos_br, signal2)
+    return signalfilt_r1_1, signalfilt_r1_2, freq_sum
 
 
 def signal_without_breath(sig1, sig2):
-    sig_res = []
-    for i in range(0, min(len(sig1), len(sig2))):
-        sig_res = np.append(sig_res, sig1[i] - sig2[i])
-    return sig_res
+    n = min(len(sig1), len(sig2))
+    return sig1[:n] - sig2[:n]
 
 
-def heart_filter(signal_r1_1, signal_r1_2):
-    """фильтрация по широкой полосе"""
+def heart_filter(signal_r1_1, signal_r1_2, tracker=None, cache=None, band=None):
+    """
+    фильтрация по широкой полосе (без второго канала - только первого, вместо него None)
+    band - полоса сердца (lhf, hhf), по умолчанию глобальная
+    """
     order = 2
-    global lowFreqHearthGlobal
-    global highFreqHearthGlobal
+    freq_low, freq_high = band if band is not None else (lowFreqHearthGlobal, highFreqHearthGlobal)
 
-    B_hb_w, A_hb_w = butter_bandpass(lowFreqHearthGlobal, highFreqHearthGlobal, fsB, order=order)
-    signalfilt_hb_r1_1_w = signal.filtfilt(B_hb_w, A_hb_w, signal_r1_1)
-    signalfilt_hb_r1_2_w = signal.filtfilt(B_hb_w, A_hb_w, signal_r1_2)
+    if cache is not None:
+        sos_hb_w = cache.heart_sos
+    else:
+        sos_hb_w = butter_bandpass_sos(freq_low, freq_high, fsB, order=order, dtype=signal_r1_1.dtype)
+    signalfilt_hb_r1_1_w = signal.sosfiltfilt(sos_hb_w, signal_r1_1)
+    signalfilt_hb_r1_2_w = None if signal_r1_2 is None else signal.sosfiltfilt(sos_hb_w, signal_r1_2)
 
-    freq_sum = fourier_analysis(signal_r1_1, signal_r1_2, fsB, lowFreqHearthGlobal, highFreqHearthGlobal)
+    freq_sum = fourier_analysis(signal_r1_1, signal_r1_2, fsB, freq_low, freq_high, tracker, cache)
 
     low_freq_hearth = freq_sum - 0.3
     if low_freq_hearth < 0:
         low_freq_hearth = 0.7
     high_freq_heath = freq_sum + 0.4
 
-    B_hb, A_hb = butter_bandpass(low_freq_hearth, high_freq_heath, fsB, order=order)
-    signalfilt_hb_r1_1 = signal.filtfilt(B_hb, A_hb, signal_r1_1)
-    signalfilt_hb_r1_2 = signal.filtfilt(B_hb, A_hb, signal_r1_2)
+    sos_hb = butter_bandpass_sos(low_freq_hearth, high_freq_heath, fsB, order=order, dtype=signal_r1_1.dtype)
+    signalfilt_hb_r1_1 = signal.sosfiltfilt(sos_hb, signal_r1_1)
+    signalfilt_hb_r1_2 = None if signal_r1_2 is None else signal.sosfiltfilt(sos_hb, signal_r1_2)
 
-    return signalfilt_hb_r1_1, signalfilt_hb_r1_2, signalfilt_hb_r1_1_w, signalfilt_hb_r1_2_w
+    return signalfilt_hb_r1_1, signalfilt_hb_r1_2, signalfilt_hb_r1_1_w, signalfilt_hb_r1_2_w, freq_sum
 
 
-def breath_rate_counter(signal_r1_1, signal_r1_2, time, lowFreqHearth, highFreqHearth, lowFreqBreath, highFreqBreath):
+def batch_find_peaks(signals, distances, prominence=peakProminence, height=None, envelopes=None):
+    """
+    Векторный поиск пиков в сигналах (..., отсчёты) без базовой линии (local_baseline): расстояние
+    distances отсчётов, высота над минимумами в окне distance не меньше prominence * огибающая
+    """
+    signals = np.asarray(signals)
+    n = signals.shape[-1]
+    rows = signals.reshape(-1, n)
+    if envelopes is None:
+        envelopes = envelope_amplitude(signals)[0]
+    envelopes = np.asarray(envelopes).reshape(-1, n)
+    row_distances = np.ceil(np.broadcast_to(distances, signals.shape[:-1])).astype(int).reshape(-1)
+    mask = np.zeros(rows.shape, dtype=bool)
+    if n < 3:
+        return mask.reshape(signals.shape)
+
+    for distance in np.unique(row_distances):
+        selected = row_distances == distance
+        x = rows[selected]
+        envelope = envelopes[selected]
+        distance = max(distance, 1)
+
+        peaks = x == ndimage.maximum_filter1d(x, 2 * distance - 1, axis=-1, mode='nearest')
+        peaks[:, 1:] &= x[:, 1:] > x[:, :-1]  # у плато берём только первый отсчёт
+        peaks[:, [0, -1]] = False
+        if height is not None:
+            peaks &= x > height
+
+        # минимумы в окнах [i - distance, i] и [i, i + distance] - только у кандидатов
+        row, column = np.nonzero(peaks)
+        windows = sliding_window_view(np.pad(x, ((0, 0), (distance, distance)), mode='edge'), distance + 1, axis=-1)
+        bottom = np.maximum(windows[row, column].min(axis=-1), windows[row, column + distance].min(axis=-1))
+        low = x[row, column] - bottom < prominence * envelope[row, column]
+        peaks[row[low], column[low]] = False
+
+        mask[selected] = peaks
+    return mask.reshape(signals.shape)
+
+
+def envelope_amplitude(signals):
+    """ Огибающая по преобразованию Гильберта и её медиана как амплитуда сигнала """
+    envelope = np.abs(signal.hilbert(signals, axis=-1))
+    return envelope, np.median(envelope, axis=-1)
+
+
+def local_baseline(signals, distances):
+    """ Скользящее среднее каждого сигнала (..., отсчёты) за 2 * distance + 1 отсчётов """
+    n = signals.shape[-1]
+    rows = signals.reshape(-1, n)
+    row_distances = np.ceil(np.broadcast_to(distances, signals.shape[:-1])).astype(int).reshape(-1)
+    baseline = np.empty_like(rows)
+    for distance in np.unique(row_distances):
+        selected = row_distances == distance
+        baseline[selected] = ndimage.uniform_filter1d(rows[selected], 2 * max(distance, 1) + 1, axis=-1,
+                                                      mode='nearest')
+    return baseline.reshape(signals.shape)
+
+
+def breath_rate_counter(signal_r1_1, signal_r1_2, time, lowFreqHearth, highFreqHearth, lowFreqBreath, highFreqBreath,
+                        dtype=np.float64, trackers=None, details=None, cache=None, estimator='peaks', artifacts=True,
+                        demodulator=None):
     """
     Предварительная обработка данных
+    trackers, cache, estimator ('peaks'/'spectrum'), demodulator (обновлённый ArcDemodulator) - необязательны,
+    details - словарь для промежуточных данных: пиков, огибающих, времени этапов, чистых участков
     """
-    global lowFreqHearthGlobal
-    global highFreqHearthGlobal
-    global lowFreqBreathGlobal
-    global highFreqBreathGlobal
-    lowFreqHearthGlobal = lowFreqHearth
-    highFreqHearthGlobal = highFreqHearth
-    lowFreqBreathGlobal = lowFreqBreath
-    highFreqBreathGlobal = highFreqBreath
-
-    signal_r1_1 = signal.detrend(signal_r1_1)  # удаляем тренд средней линии
-    signal_r1_2 = signal.detrend(signal_r1_2)
-
-    signalfilt_br_r1_1, signalfilt_br_r1_2 = breath_filter(signal_r1_1, signal_r1_2)
+    stage_start = perf_counter()
+    bands = (lowFreqHearth, highFreqHearth, lowFreqBreath, highFreqBreath)
+
+    signal_r1_1 = np.asarray(signal_r1_1, dtype=dtype)
+    signal_r1_2 = np.asarray(signal_r1_2, dtype=dtype)
+    n = min(len(signal_r1_1), len(signal_r1_2))
+    segments = [(0, n)]
+    if artifacts:
+        segments = clean_segments(artifact_mask(signal_r1_1[:n], signal_r1_2[:n]), int(minSegment * fsB))
+    stage_artifacts = perf_counter()
+
+    if segments == [(0, n)]:
+        result = segment_rate_counter(signal_r1_1, signal_r1_2, time, dtype, trackers, details, cache, estimator,
+                                      demodulator, bands)
+    else:
+        result = merge_segments(signal_r1_1, signal_r1_2, segments, dtype, trackers, details, estimator,
+                                demodulator, bands)
+
+    if details is not None:
+        details['segments'] = segments
+        details['coverage'] = sum(end - begin for begin, end in segments) / n if n else 0.0
+        details['stage_times']['artifacts'] = stage_artifacts - stage_start
+    return result
+
+
+def artifact_mask(signal1, signal2, fs=fsB, smooth=5, trend=10, guard=1.0):
+    """
+    Маска отсчётов, испорченных движением. Отсчёт плохой, если в одном из каналов
+    приращение сглаженного сигнала за smooth отсчётов больше artifactDerivative
+    скользящих (за trend секунд) СКО приращения или отклонение от скользящего среднего
+    больше artifactAmplitude робастных СКО окна. Маска расширяется на guard секунд.
+    """
+    x = np.stack((signal1, signal2))
+    n = x.shape[-1]
+    if n <= smooth:
+        return np.zeros(n, dtype=bool)
+    size = min(int(trend * fs), n)
+
+    smoothed = ndimage.uniform_filter1d(x, smooth, axis=-1, mode='nearest')
+    derivative = np.zeros_like(x)
+    derivative[:, smooth // 2:smooth // 2 + n - smooth] = np.abs(smoothed[:, smooth:] - smoothed[:, :-smooth])
+    derivative_rms = np.sqrt(ndimage.uniform_filter1d(derivative * derivative, size, axis=-1, mode='nearest'))
+
+    deviation = np.abs(x - ndimage.uniform_filter1d(x, size, axis=-1, mode='nearest'))
+    deviation_scale = 1.4826 * np.median(deviation, axis=-1, keepdims=True)  # СКО по медиане, устойчиво к выбросам
+
+    bad = np.any((derivative > artifactDerivative * np.maximum(derivative_rms, artifactFloor)) |
+                 (deviation > artifactAmplitude * np.maximum(deviation_scale, artifactFloor)), axis=0)
+    guard = int(guard * fs)
+    if guard:
+        bad = ndimage.binary_dilation(bad, np.ones(2 * guard + 1, dtype=bool))
+    return bad
+
+
+def clean_segments(mask, min_length):
+    """ Границы (начало, конец) участков без артефактов не короче min_length отсчётов """
+    edges = np.flatnonzero(np.diff(np.concatenate(([True], mask, [True])).astype(np.int8)))
+    begins, ends = edges[::2], edges[1::2]
+    keep = ends - begins >= min_length
+    return list(zip(begins[keep].tolist(), ends[keep].tolist()))
+
+
+def merge_segments(signal_r1_1, signal_r1_2, segments, dtype, trackers=None, details=None, estimator='peaks',
+                   demodulator=None, bands=None):
+    """
+    Обработка только чистых участков окна. Частоты - средние по участкам с весом их длины
+    (для оценки по пикам это число пиков, делённое на чистое время), сигналы вне участков
+    нулевые, пики - в отсчётах всего окна. Трекеры получает только самый длинный участок.
+    """
+    n = min(len(signal_r1_1), len(signal_r1_2))
+    signals = np.zeros((6, n), dtype=dtype)  # сердце 1, 2, широкая полоса 1, 2, дыхание 1, 2
+    envelopes = np.zeros((4, n), dtype=dtype)
+    peaks = [[] for i in range(6)]
+    rates = np.zeros(5)  # ЧСС, ЧД, ЧСС по широкой полосе, частоты сердца и дыхания
+    amplitudes = np.zeros(2)
+    stage_times = {}
+    clean = sum(end - begin for begin, end in segments)
+    longest = max(segments, key=lambda segment: segment[1] - segment[0]) if segments else None
+
+    for begin, end in segments:
+        part = {}
+        result = segment_rate_counter(signal_r1_1[begin:end], signal_r1_2[begin:end], (end - begin) / fsB, dtype,
+                                      trackers if (begin, end) == longest else None, part, None, estimator,
+                                      demodulator, bands)
+        weight = (end - begin) / clean
+        rates += weight * np.array([result[0], result[1], part['heart_rate_wide'],
+                                    part['heart_freq'], part['breath_freq']])
+        amplitudes += weight * np.array([part['heart_amplitude'], part['breath_amplitude']])
+        for i, sig in enumerate((result[2], result[3], *part['signals_hb_w'], result[6], result[7])):
+            signals[i, begin:end] = sig
+        envelopes[:, begin:end] = np.concatenate((part['envelopes_hb_w'], part['envelopes_br']))
+        for i, segment_peaks in enumerate((result[4], result[5], *part['peaks_hb_w'], result[8], result[9])):
+            peaks[i].append(np.asarray(segment_peaks, dtype=int) + begin)
+        for stage, duration in part['stage_times'].items():
+            stage_times[stage] = stage_times.get(stage, 0) + duration
+
+    peaks = [np.concatenate(channel_peaks) if channel_peaks else np.array([], dtype=int) for channel_peaks in peaks]
+    if details is not None:
+        details['heart_rate_wide'] = float(rates[2])
+        details['peaks_hb_w'] = (peaks[2], peaks[3])
+        details['signals_hb_w'] = (signals[2], signals[3])
+        details['envelopes_hb_w'] = (envelopes[0], envelopes[1])
+        details['envelopes_br'] = (envelopes[2], envelopes[3])
+        details['heart_amplitude'] = float(amplitudes[0])
+        details['breath_amplitude'] = float(amplitudes[1])
+        details['heart_freq'] = float(rates[3])
+        details['breath_freq'] = float(rates[4])
+        details['stage_times'] = stage_times
+
+    return float(rates[0]), float(rates[1]), signals[0], signals[1], peaks[0], peaks[1], \
+           signals[4], signals[5], peaks[4], peaks[5]
+
+
+def segment_rate_counter(signal_r1_1, signal_r1_2, time, dtype=np.float64, trackers=None, details=None, cache=None,
+                         estimator='peaks', demodulator=None, bands=None):
+    """
+    Обработка непрерывного участка сигнала, параметры как у breath_rate_counter,
+    bands - (lhf, hhf, lbf, hbf), по умолчанию глобальные полосы
+    """
+    if bands is None:
+        bands = (lowFreqHearthGlobal, highFreqHearthGlobal, lowFreqBreathGlobal, highFreqBreathGlobal)
+    lowFreqHearth, highFreqHearth, lowFreqBreath, highFreqBreath = bands
+    stage_start = perf_counter()
+    if demodulator is not None:
+        # отсутствие объекта определяется по квадратуре: у фазы шума пустой сцены нет масштаба
+        flat = np.ptp(signal.detrend(np.asarray(signal_r1_1, dtype=dtype))) < 0.015
+        arc = demodulator.demodulate(signal_r1_1, signal_r1_2).astype(dtype)
+        stage_demodulation = perf_counter()
+        signal_r1_1, signal_r1_2 = signal.detrend(arc), None
+    else:
+        stage_demodulation = stage_start
+        signal_r1_1 = signal.detrend(np.asarray(signal_r1_1, dtype=dtype))  # удаляем тренд средней линии
+        signal_r1_2 = signal.detrend(np.asarray(signal_r1_2, dtype=dtype))
+        flat = np.ptp(signal_r1_1) < 0.015
+    single = signal_r1_2 is None
+    stage_detrend = perf_counter()
+
+    n = len(signal_r1_1) if single else min(len(signal_r1_1), len(signal_r1_2))
+    if cache is not None and not cache.matches(n, bands, dtype):
+        cache = None
+
+    breath_tracker, heart_tracker = trackers if trackers is not None else (None, None)
+
+    signalfilt_br_r1_1, signalfilt_br_r1_2, breath_freq = breath_filter(signal_r1_1, signal_r1_2, breath_tracker,
+                                                                         cache, bands[2:])
+    stage_breath = perf_counter()
 
     signalfilt_hb_r1_1 = signal_without_breath(signal_r1_1, signalfilt_br_r1_1)
-    signalfilt_hb_r1_2 = signal_without_breath(signal_r1_2, signalfilt_br_r1_2)
+    signalfilt_hb_r1_2 = None if single else signal_without_breath(signal_r1_2, signalfilt_br_r1_2)
 
     signalfilt_hb_r1_1, signalfilt_hb_r1_2, \
-    signalfilt_hb_r1_1_w, signalfilt_hb_r1_2_w = heart_filter(signalfilt_hb_r1_1, signalfilt_hb_r1_2)
+    signalfilt_hb_r1_1_w, signalfilt_hb_r1_2_w, heart_freq = heart_filter(signalfilt_hb_r1_1, signalfilt_hb_r1_2,
+                                                                           heart_tracker, cache, bands[:2])
+    stage_heart = perf_counter()
 
     '''Поиск пиков'''
-    # peaks_hb_r1_1_w = find_peaks(signalfilt_hb_r1_1_w, distance=fsB / highcut_hb)[0]
-    # peaks_hb_r1_2_w = find_peaks(signalfilt_hb_r1_2_w, distance=fsB / highcut_hb)[0]
-    # peaks_hb_r2_1_w = find_peaks(signalfilt_hb_r2_1_w, distance=fsB / highcut_hb)[0]
-    # peaks_hb_r2_2_w = find_peaks(signalfilt_hb_r2_2_w, distance=fsB / highcut_hb)[0]
-
-    peaks_hb_r1_1 = find_peaks(signalfilt_hb_r1_1, distance=fsB / highFreqHearthGlobal)[0]
-    peaks_hb_r1_2 = find_peaks(signalfilt_hb_r1_2, distance=fsB / highFreqHearthGlobal)[0]
-
-    peaks_br_r1_1 = find_peaks(signalfilt_br_r1_1, distance=fsB / highFreqBreathGlobal)[0]
-    peaks_br_r1_2 = find_peaks(signalfilt_br_r1_2, distance=fsB / highFreqBreathGlobal)[0]
+    peak_signals = [signalfilt_hb_r1_1, signalfilt_hb_r1_2, signalfilt_hb_r1_1_w, signalfilt_hb_r1_2_w,
+                    signalfilt_br_r1_1, signalfilt_br_r1_2]
+    distances = [fsB / highFreqHearth] * 4 + [fsB / highFreqBreath] * 2
+    if single:
+        peak_signals, distances = peak_signals[::2], distances[::2]
+    peak_signals = np.stack(peak_signals)
+    peak_signals = peak_signals - local_baseline(peak_signals, distances)  # полоса дыхания от 0.01 Гц - дрейф
+    envelopes, amplitudes = envelope_amplitude(peak_signals)
+    peaks = [np.flatnonzero(mask) for mask in batch_find_peaks(peak_signals, distances, envelopes=envelopes)]
+    if single:  # оба канала результата - сигнал фазы
+        peaks = [channel_peaks for channel_peaks in peaks for channel in range(2)]
+        envelopes = np.repeat(envelopes, 2, axis=0)
+        amplitudes = np.repeat(amplitudes, 2)
+        signalfilt_hb_r1_2, signalfilt_hb_r1_2_w, signalfilt_br_r1_2 = \
+            signalfilt_hb_r1_1, signalfilt_hb_r1_1_w, signalfilt_br_r1_1
+    peaks_hb_r1_1, peaks_hb_r1_2, peaks_hb_r1_1_w, peaks_hb_r1_2_w, peaks_br_r1_1, peaks_br_r1_2 = peaks
+    stage_peaks = perf_counter()
 
     total_breath_rate = (len(peaks_br_r1_1) + len(peaks_br_r1_2)) / 2
     total_breath_rate = total_breath_rate / time * 60
@@ -130,14 +563,105 @@ def breath_rate_counter(signal_r1_1, signal_r1_2, time, lowFreqHearth, highFreqH
     total_heart_rate = (len(peaks_hb_r1_1) + len(peaks_hb_r1_2)) / 2
     total_heart_rate = total_heart_rate / time * 60
 
-    if abs(min(signal_r1_1) - max(signal_r1_1)) < 0.015:
+    if estimator == 'spectrum':
+        total_breath_rate = float(breath_freq) * 60
+        total_heart_rate = float(heart_freq) * 60
+
+    if flat:
         total_heart_rate = 0
         total_breath_rate = 0
         peaks_br_r1_1, peaks_br_r1_2, peaks_hb_r1_1, peaks_hb_r1_2 = [np.array([]) for i in range(4)]
+        peaks_hb_r1_1_w, peaks_hb_r1_2_w = np.array([]), np.array([])
+
+    if details is not None:
+        details['heart_rate_wide'] = (len(peaks_hb_r1_1_w) + len(peaks_hb_r1_2_w)) / 2 / time * 60
+        details['peaks_hb_w'] = (peaks_hb_r1_1_w, peaks_hb_r1_2_w)
+        details['signals_hb_w'] = (signalfilt_hb_r1_1_w, signalfilt_hb_r1_2_w)
+        details['envelopes_hb_w'] = (envelopes[2], envelopes[3])
+        details['envelopes_br'] = (envelopes[4], envelopes[5])
+        details['heart_amplitude'] = float(np.mean(amplitudes[2:4]))  # по широкой полосе
+        details['breath_amplitude'] = float(np.mean(amplitudes[4:]))
+        details['heart_freq'] = heart_freq
+        details['breath_freq'] = breath_freq
+        details['stage_times'] = {'detrend': stage_detrend - stage_demodulation,
+                                  'breath_filter': stage_breath - stage_detrend,
+                                  'heart_filter': stage_heart - stage_breath,
+                                  'peaks': stage_peaks - stage_heart}
+        if demodulator is not None:
+            details['stage_times']['demodulation'] = stage_demodulation - stage_start
 
     return total_heart_rate, total_breath_rate, \
            signalfilt_hb_r1_1, signalfilt_hb_r1_2, peaks_hb_r1_1,  peaks_hb_r1_2, \
            signalfilt_br_r1_1, signalfilt_br_r1_2, peaks_br_r1_1, peaks_br_r1_2
 
 
+def sliding_windows(signal_r1_1, signal_r1_2, n_samples, hop):
+    """ Нарезает запись на окна (число окон, n_samples, 2 канала) без копирования """
+    channels = np.stack((signal_r1_1, signal_r1_2), axis=-1)
+    windows = np.lib.stride_tricks.sliding_window_view(channels, n_samples, axis=0)[::hop]
+    return np.moveaxis(windows, 1, 2)
+
 
+def batch_bandpass(sig, low, high, order):
+    """
+    Полосовая фильтрация окон sig (окна, каналы, отсчёты) с полосой [low[i], high[i]] для i-го окна.
+    Частоты кратны шагу спектра, поэтому фильтр рассчитывается один раз на каждую различную полосу.
+    """
+    out = np.empty_like(sig)
+    bands, inverse = np.unique(np.stack((low, high), axis=1), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    for k, (band_low, band_high) in enumerate(bands):
+        rows = inverse == k
+        sos = butter_bandpass_sos(band_low, band_high, fsB, order=order, dtype=sig.dtype)
+        out[rows] = signal.sosfiltfilt(sos, sig[rows], axis=-1)
+    return out
+
+
+def breath_rate_counter_batch(windows, time, lowFreqHearth, highFreqHearth, lowFreqBreath, highFreqBreath,
+                              dtype=np.float64, return_signals=False):
+    """
+    Пакетная обработка окон для повторного анализа записей.
+    windows - массив (число окон, отсчёты, 2 канала), например из sliding_windows
+    Возвращает массивы ЧСС и ЧД и списки пиков по окнам (сердце 1, сердце 2, дыхание 1, дыхание 2),
+    при return_signals=True - ещё отфильтрованные сигналы (окна, 2 канала, отсчёты)
+    """
+    order = 2
+    windows = np.asarray(windows, dtype=dtype)
+    sig = signal.detrend(np.ascontiguousarray(np.moveaxis(windows, 2, 1)), axis=-1)  # удаляем тренд
+
+    n = sig.shape[-1]
+    plan = spectral_plan(n, fsB, lowFreqBreath, highFreqBreath)
+    freq_br = plan.batch_peak(plan.magnitudes(sig[:, 0], sig[:, 1]))
+    low_br = np.where(freq_br - 0.1 <= 0, 0.01, freq_br - 0.1)
+    signalfilt_br = batch_bandpass(sig, low_br, freq_br + 0.1, order)
+
+    signal_hb = sig - signalfilt_br  # сигнал без дыхания
+
+    sos_hb_w = butter_bandpass_sos(lowFreqHearth, highFreqHearth, fsB, order=order, dtype=dtype)
+    signalfilt_hb_w = signal.sosfiltfilt(sos_hb_w, signal_hb, axis=-1)
+
+    plan = spectral_plan(n, fsB, lowFreqHearth, highFreqHearth)
+    freq_hb = plan.batch_peak(plan.magnitudes(signal_hb[:, 0], signal_hb[:, 1]))
+    low_hb = np.where(freq_hb - 0.3 < 0, 0.7, freq_hb - 0.3)
+    signalfilt_hb = batch_bandpass(signal_hb, low_hb, freq_hb + 0.4, order)
+
+    '''Поиск пиков'''
+    distances = (fsB / highFreqHearth, fsB / highFreqBreath)
+    peak_masks = tuple(batch_find_peaks(x - local_baseline(x, distance), distance)
+                       for x, distance in zip((signalfilt_hb, signalfilt_br), distances))
+    peaks = tuple([np.flatnonzero(row) for row in mask[:, channel]] for mask in peak_masks for channel in (0, 1))
+
+    counts = np.stack([mask.sum(axis=-1) for mask in peak_masks]).astype(float)  # (сердце/дыхание, окна, каналы)
+    total_heart_rate = counts[0].mean(axis=-1) / time * 60
+    total_breath_rate = counts[1].mean(axis=-1) / time * 60
+
+    no_signal = np.ptp(sig[:, 0], axis=-1) < 0.015
+    total_heart_rate[no_signal] = 0
+    total_breath_rate[no_signal] = 0
+    for i in np.flatnonzero(no_signal):
+        for channel_peaks in peaks:
+            channel_peaks[i] = np.array([])
+
+    if return_signals:
+        return total_heart_rate, total_breath_rate, peaks, signalfilt_hb, signalfilt_br, signalfilt_hb_w
+    return total_heart_rate, total_breath_rate, peaks
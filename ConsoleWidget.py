@@ -7,8 +7,11 @@ from PyQt5 import QtCore
 # QPlainTextEdit can only have one text color but scolls nice with line add
 
 class ConsoleWidget(QPlainTextEdit):
+    maxLines = 1000  # older lines are dropped so the text does not grow during long sessions
+
     def __init__(self, parent):
         super(self.__class__, self).__init__(parent)
+        self.setMaximumBlockCount(self.maxLines)
 
     @QtCore.pyqtSlot(str, 'QColor')
     def printMessage(self, msg, color=None):
@@ -0,0 +1,222 @@
+from collections import deque
+
+import numpy as np
+from scipy import signal, ndimage
+
+from BreathingRateCounter import fsB, butter_bandpass_sos
+
+
+class Event:
+    """ Alarm raised or cleared by EventDetector, time in ms from the start of the registration """
+    __slots__ = ('time', 'kind', 'active', 'value')
+
+    names = {'apnea': 'Apnea', 'bradycardia': 'Bradycardia', 'tachycardia': 'Tachycardia',
+             'signal_loss': 'Signal loss'}
+
+    def __init__(self, time, kind, active, value=None):
+        self.time = int(time)
+        self.kind = kind
+        self.active = active
+        self.value = None if value is None else float(value)
+
+    def message(self):
+        text = "%s %s" % (self.names[self.kind], 'started' if self.active else 'ended')
+        if self.value is not None:
+            text += " (%.0f)" % self.value
+        seconds = self.time // 1000
+        return "%02d:%02d:%02d %s" % (seconds // 3600, seconds // 60 % 60, seconds % 60, text)
+
+    def toDict(self):
+        return {'type': 'event', 'T': self.time, 'event': self.kind, 'active': self.active, 'value': self.value}
+
+
+class CycleDetector:
+    """ Breaths or heart beats of one channel: a causal band-pass filter and a hysteresis
+
+        A cycle is counted when the filtered signal rises above +threshold after it
+        was below -threshold. The threshold follows the largest recent amplitude, which
+        decays with the time constant tau, so a stop of the movement is not mistaken
+        for a smaller amplitude.
+    """
+
+    def __init__(self, low, high, tau, minAmplitude, threshold=0.3, fs=fsB):
+        self.sos = butter_bandpass_sos(low, high, fs, order=2)
+        self.tau = tau
+        self.minAmplitude = minAmplitude
+        self.threshold = threshold
+        self.fs = fs
+        self.reset()
+
+    def reset(self):
+        self.zi = None
+        self.reference = 0
+        self.state = 0
+
+    def feed(self, x, T_meas):
+        """ Returns the times of the cycles that started in the block """
+        if self.zi is None:
+            self.zi = signal.sosfilt_zi(self.sos) * x[0]
+        y, self.zi = signal.sosfilt(self.sos, x, zi=self.zi)
+
+        self.reference = max(self.reference * np.exp(-len(x) / (self.tau * self.fs)), float(np.max(np.abs(y))))
+        threshold = max(self.threshold * self.reference, self.minAmplitude)
+
+        codes = (y > threshold).astype(np.int8) - (y < -threshold)
+        crossings = np.flatnonzero(codes)
+        if len(crossings) == 0:
+            return T_meas[:0]
+        codes = codes[crossings]
+        previous = np.concatenate(([self.state], codes[:-1]))
+        self.state = codes[-1]
+        return T_meas[crossings[(codes == 1) & (previous == -1)]]
+
+
+class EventDetector:
+    """ Low-latency alarms computed on every block of samples instead of every calculation interval
+
+        apnea       - no breath for apneaSeconds
+        bradycardia - heart rate (median of the beat intervals of rateSeconds) below bradyRate
+        tachycardia - heart rate above tachyRate
+        signal_loss - both channels flat or no samples for lossSeconds
+
+        feed() returns Event objects for alarms that started or ended in the block.
+        With an ArcDemodulator (updated with the blocks by the owner) breaths and beats
+        are detected in its single arc signal instead of both channels.
+    """
+    flatRange = 0.015  # the same criterion of a flat signal as in breath_rate_counter
+    hysteresis = 5  # beats/min between raising and clearing a heart rate alarm
+    rateSeconds = 12  # heart rate is the median of the beat intervals of this period
+
+    def __init__(self, bands=(0.7, 2.5, 0.01, 0.4), apneaSeconds=20, bradyRate=50, tachyRate=120, lossSeconds=3,
+                 demodulator=None):
+        self.apneaSeconds = apneaSeconds
+        self.bradyRate = bradyRate
+        self.tachyRate = tachyRate
+        self.lossSeconds = lossSeconds
+        self.demodulator = demodulator
+        self.breathDetectors, self.heartDetectors, self.beats = [], [], []
+        self.setBands(bands)
+        self.reset()
+
+    def setBands(self, bands):
+        """ New cycle detectors for the bands, the active alarms and the detected beats are kept """
+        self.bands = bands
+        lhf, hhf, lbf, hbf = bands
+        channels = 1 if self.demodulator is not None else 2
+        # the lowest breath frequencies are drift for a causal filter
+        breathDetectors = [CycleDetector(max(lbf, 0.1), hbf, 60, 0.002) for channel in range(channels)]
+        heartDetectors = [CycleDetector(lhf, hhf, 10, 0.001) for channel in range(channels)]
+        # only the filters start anew: the amplitudes of the same signals are kept, and a small
+        # signal during an apnea does not count as breaths after a switch of the demodulation either
+        if len(self.breathDetectors) == channels:
+            for detector, previous in zip(breathDetectors + heartDetectors, self.breathDetectors + self.heartDetectors):
+                detector.reference = previous.reference
+        else:
+            for detector in breathDetectors:
+                detector.reference = max((previous.reference for previous in self.breathDetectors), default=0)
+        self.breathDetectors, self.heartDetectors = breathDetectors, heartDetectors
+        if len(self.beats) != channels:  # the channel with more beats continues in every new channel
+            beats = max(self.beats, key=len, default=())
+            self.beats = [deque(beats, maxlen=30) for channel in range(channels)]
+        self.lastArc = None
+        self.lastSample = None
+
+    def setDemodulator(self, demodulator):
+        """ Switches between the arc signal and both channels, the alarms are kept """
+        if demodulator is not self.demodulator:
+            self.demodulator = demodulator
+            self.setBands(self.bands)
+
+    def reset(self):
+        for detector in self.breathDetectors + self.heartDetectors:
+            detector.reset()
+        self.beats = [deque(maxlen=30) for detector in self.heartDetectors]
+        self.lastArc = None
+        self.lastSample = None
+        self.lastBreath = None
+        self.lastT = None
+        self.tail = np.empty((2, 0))  # the last lossSeconds without one sample
+        self.active = set()
+        self.heartRate = 0
+
+    def change(self, events, T, kind, active, value=None):
+        if active != (kind in self.active):
+            (self.active.add if active else self.active.discard)(kind)
+            events.append(Event(T, kind, active, value))
+
+    def feed(self, a_ch0, a_ch1, T_meas):
+        if len(T_meas) == 0:
+            return []
+        events = []
+        channels = np.stack((a_ch0, a_ch1)) / 8000
+        T_meas = np.asarray(T_meas, dtype=np.int64)
+        T_end = int(T_meas[-1])
+        lossSamples = int(self.lossSeconds * fsB)
+
+        if self.lastT is not None and T_meas[0] - self.lastT > self.lossSeconds * 1000:  # no samples
+            self.change(events, self.lastT + self.lossSeconds * 1000, 'signal_loss', True)
+        self.lastT = T_end
+
+        # flat: the range of both channels over the last lossSeconds, for every sample of the block
+        window = np.concatenate((self.tail, channels), axis=1)
+        self.tail = window[:, max(window.shape[1] - (lossSamples - 1), 0):]
+        origin = (lossSamples - 1) // 2  # window [i - lossSamples + 1, i]
+        ranges = ndimage.maximum_filter1d(window, lossSamples, axis=1, mode='nearest', origin=origin) - \
+            ndimage.minimum_filter1d(window, lossSamples, axis=1, mode='nearest', origin=origin)
+        flat = np.all(ranges[:, -len(T_meas):] < self.flatRange, axis=0)
+        flat[:max(lossSamples - window.shape[1] + len(T_meas) - 1, 0)] = False  # window not filled yet
+
+        states = np.concatenate((['signal_loss' in self.active], flat))
+        for i in np.flatnonzero(np.diff(states)):
+            self.change(events, T_meas[i], 'signal_loss', bool(flat[i]))
+        if events and not flat[-1]:
+            self.lastBreath = None  # the subject is observed again from now on
+            self.lastArc = None
+            self.lastSample = None
+            for beats in self.beats:
+                beats.clear()
+            for detector in self.breathDetectors + self.heartDetectors:
+                detector.reset()  # the step at the end of the loss is not a cycle
+
+        if self.demodulator is not None:
+            if self.lastArc is None:
+                arc = self.demodulator.demodulate(channels[0], channels[1])
+            else:
+                # the last sample is demodulated again with the current fit and keeps its value,
+                # so a refit or a switch to the projection shifts the arc instead of stepping it
+                arc = self.demodulator.demodulate(np.concatenate(([self.lastSample[0]], channels[0])),
+                                                  np.concatenate(([self.lastSample[1]], channels[1])))
+                arc = arc[1:] - arc[0] + self.lastArc
+            self.lastSample = channels[:, -1]
+            self.lastArc = arc[-1]
+            channels = arc[np.newaxis]
+        breaths = np.concatenate([detector.feed(channel, T_meas)
+                                  for detector, channel in zip(self.breathDetectors, channels)])
+        for beats, detector, channel in zip(self.beats, self.heartDetectors, channels):
+            beats.extend(detector.feed(channel, T_meas).tolist())
+        if 'signal_loss' in self.active:
+            return events
+
+        if self.lastBreath is None:
+            self.lastBreath = int(T_meas[0])
+        if len(breaths):
+            if 'apnea' in self.active:
+                self.change(events, breaths.min(), 'apnea', False, (breaths.min() - self.lastBreath) / 1000)
+            self.lastBreath = int(breaths.max())
+        elif T_end - self.lastBreath > self.apneaSeconds * 1000:
+            self.change(events, self.lastBreath + self.apneaSeconds * 1000, 'apnea', True, self.apneaSeconds)
+
+        # beats are missed rather than added, so the channel with more recent beats is the better one
+        recent = [np.fromiter(beats, np.int64) for beats in self.beats]
+        beats = max((beats[beats > T_end - self.rateSeconds * 1000] for beats in recent), key=len)
+        if len(beats) >= 6:
+            self.heartRate = 60000 / np.median(np.diff(beats))
+            if self.heartRate < self.bradyRate:
+                self.change(events, T_end, 'bradycardia', True, self.heartRate)
+            elif self.heartRate >= self.bradyRate + self.hysteresis:
+                self.change(events, T_end, 'bradycardia', False, self.heartRate)
+            if self.heartRate > self.tachyRate:
+                self.change(events, T_end, 'tachycardia', True, self.heartRate)
+            elif self.heartRate <= self.tachyRate - self.hysteresis:
+                self.change(events, T_end, 'tachycardia', False, self.heartRate)
+        return events
@@ -0,0 +1,197 @@
+import numpy as np
+
+
+class FrameDecoder:
+    """ Splits the byte stream of the radar into ch0/ch1 samples
+
+        Every frame is two little-endian uint16 values (ch0, ch1),
+        timestamps are counted from the start of the registration.
+    """
+    frameSize = 4
+
+    def __init__(self, dt_ms=20):
+        self.dt_ms = dt_ms
+        self.reset()
+
+    def reset(self):
+        self.buffer = bytearray()
+        self.T_ms = 0
+
+    def feed(self, data):
+        """ Returns a_ch0, a_ch1, T_meas arrays of the complete frames received so far """
+        self.buffer += data
+        count = len(self.buffer) // self.frameSize
+        chunk = bytes(self.buffer[:count * self.frameSize])
+        del self.buffer[:count * self.frameSize]
+
+        frames = np.frombuffer(chunk, dtype='<u2').reshape(-1, 2)
+        T_meas = self.T_ms + self.dt_ms * np.arange(1, count + 1)
+        if count:
+            self.T_ms = int(T_meas[-1])
+        return frames[:, 0], frames[:, 1], T_meas
+
+
+class SyncFrameDecoder:
+    """ Decoder of the framed protocol
+
+        frame = sync word 0xA55A, sequence number, ch0, ch1, checksum
+        (five little-endian uint16, checksum = (seq + ch0 + ch1) mod 2**16)
+
+        Frame boundaries are searched in the whole buffer at once, so a dropped
+        or extra byte only costs the frames it touches. Lost frames are detected
+        by the sequence counter and the timestamps move past them; gaps of up to
+        maxGap frames are filled by linear interpolation, longer ones are left
+        out of the samples. A repeated frame number is a duplicate and is dropped.
+        A jump of more than maxLostMs (device restart, counter reset) cannot be
+        a gap and is a resync: the frame is taken as the next one.
+    """
+    frameSize = 10
+    syncWord = 0xA55A
+    maxGap = 5  # longest gap in frames filled by interpolation
+    maxLostMs = 10000  # longest gap that is still a gap rather than a resync
+
+    def __init__(self, dt_ms=20):
+        self.dt_ms = dt_ms
+        self.reset()
+
+    def reset(self):
+        self.buffer = bytearray()
+        self.T_ms = 0
+        self.lastSeq = None
+        self.lastSample = None
+        self.lostFrames = 0
+        self.skippedBytes = 0
+        self.duplicateFrames = 0
+        self.resyncs = 0
+
+    def feed(self, data):
+        self.buffer += data
+        raw = np.frombuffer(bytes(self.buffer), dtype=np.uint8)
+        empty = np.empty(0, dtype=np.uint16)
+
+        # every position where the sync word could start a complete frame
+        starts = np.flatnonzero((raw[:-1] == (self.syncWord & 0xFF)) & (raw[1:] == (self.syncWord >> 8)))
+        starts = starts[starts + self.frameSize <= len(raw)]
+
+        words = raw[starts[:, None] + np.arange(self.frameSize)].view('<u2')
+        valid = (words[:, 1].astype(np.uint32) + words[:, 2] + words[:, 3]) & 0xFFFF == words[:, 4]
+        starts, words = starts[valid], words[valid]
+
+        # a sync word inside the payload of an accepted frame is not a frame
+        if np.any(np.diff(starts) < self.frameSize):
+            keep = np.zeros(len(starts), dtype=bool)
+            lastStart = -self.frameSize
+            for k, start in enumerate(starts.tolist()):
+                if start - lastStart >= self.frameSize:
+                    keep[k] = True
+                    lastStart = start
+            starts, words = starts[keep], words[keep]
+
+        if len(starts) == 0:
+            consumed = max(len(raw) - self.frameSize + 1, 0)
+            self.skippedBytes += consumed
+            del self.buffer[:consumed]
+            return empty, empty, np.empty(0, dtype=np.int64)
+
+        consumed = int(starts[-1]) + self.frameSize
+        self.skippedBytes += consumed - len(starts) * self.frameSize
+        del self.buffer[:consumed]
+
+        return self.fillGaps(words[:, 1], words[:, 2], words[:, 3])
+
+    def fillGaps(self, seq, a_ch0, a_ch1):
+        # frame numbers relative to the last decoded frame, unwrapping the 16-bit counter
+        seq = seq.astype(np.int64)
+        previous = seq[0] - 1 if self.lastSeq is None else self.lastSeq
+        steps = np.diff(np.concatenate(([previous], seq))) % 65536
+        duplicates = steps == 0
+        if np.any(duplicates):
+            self.duplicateFrames += int(np.count_nonzero(duplicates))
+            seq, a_ch0, a_ch1, steps = seq[~duplicates], a_ch0[~duplicates], a_ch1[~duplicates], steps[~duplicates]
+            if len(seq) == 0:
+                empty = np.empty(0, dtype=np.uint16)
+                return empty, empty, np.empty(0, dtype=np.int64)
+        resyncs = steps > self.maxLostMs // self.dt_ms + 1
+        self.resyncs += int(np.count_nonzero(resyncs))
+        steps[resyncs] = 1
+        positions = np.cumsum(steps)
+        self.lostFrames += int(positions[-1] - len(seq))
+
+        # grid positions of the frames and of the interpolated gaps, long gaps stay empty
+        grid = np.arange(1, positions[-1] + 1)
+        frame = np.repeat(np.arange(len(seq)), steps)
+        grid = grid[(steps[frame] <= self.maxGap + 1) | (grid == positions[frame])]
+        T_meas = self.T_ms + self.dt_ms * grid
+        if len(grid) != len(seq):
+            known = positions
+            if self.lastSample is not None:  # interpolate from the last sample of the previous chunk
+                known = np.concatenate(([0], positions))
+                a_ch0 = np.concatenate(([self.lastSample[0]], a_ch0))
+                a_ch1 = np.concatenate(([self.lastSample[1]], a_ch1))
+            a_ch0 = np.rint(np.interp(grid, known, a_ch0)).astype(np.uint16)
+            a_ch1 = np.rint(np.interp(grid, known, a_ch1)).astype(np.uint16)
+
+        self.lastSeq = int(seq[-1])
+        self.lastSample = (a_ch0[-1], a_ch1[-1])
+        self.T_ms = int(T_meas[-1])
+        return a_ch0, a_ch1, T_meas
+
+
+def encode_frames(seq, a_ch0, a_ch1):
+    """ Packs samples into frames of the framed protocol """
+    words = np.empty((len(a_ch0), 5), dtype='<u2')
+    words[:, 0] = SyncFrameDecoder.syncWord
+    words[:, 1] = np.asarray(seq) & 0xFFFF
+    words[:, 2] = a_ch0
+    words[:, 3] = a_ch1
+    words[:, 4] = (words[:, 1].astype(np.uint32) + words[:, 2] + words[:, 3]) & 0xFFFF
+    return words.tobytes()
+
+
+class IntervalBuffer:
+    """ Collects samples into calculation intervals of intervalMs milliseconds
+
+        Completed intervals are returned as uint16 (ch0, ch1) and uint32 (T) arrays.
+    """
+
+    def __init__(self, intervalMs):
+        self.intervalMs = intervalMs
+        self.reset()
+
+    def reset(self):
+        self.chunks = []
+        self.lastT = None
+
+    def append(self, a_ch0, a_ch1, T_meas):
+        """ Returns the list of (a_ch0, a_ch1, T_meas) intervals completed by the new samples
+
+            An interval ends with the sample at its boundary time, or with the
+            last sample before it when the boundary sample itself was lost.
+        """
+        T_meas = np.asarray(T_meas)
+        if len(T_meas) == 0:
+            return []
+        keys = (T_meas - 1) // self.intervalMs
+        previousKey = keys[0] if self.lastT is None else (self.lastT - 1) // self.intervalMs
+
+        completed = []
+        begin = 0
+        for end in np.flatnonzero(np.diff(np.concatenate(([previousKey], keys))) != 0):
+            self.extend(a_ch0[begin:end], a_ch1[begin:end], T_meas[begin:end])
+            completed.append(self.take())
+            begin = end
+        self.extend(a_ch0[begin:], a_ch1[begin:], T_meas[begin:])
+        if self.lastT is not None and self.lastT % self.intervalMs == 0:
+            completed.append(self.take())
+        return completed
+
+    def extend(self, a_ch0, a_ch1, T_meas):
+        if len(T_meas):
+            self.chunks.append((a_ch0, a_ch1, T_meas))
+            self.lastT = int(T_meas[-1])
+
+    def take(self):
+        a_ch0, a_ch1, T_meas = (np.concatenate(parts) for parts in zip(*self.chunks))
+        self.reset()
+        return a_ch0.astype(np.uint16, copy=False), a_ch1.astype(np.uint16, copy=False), \
+            T_meas.astype(np.uint32, copy=False)
@@ -0,0 +1,84 @@
+import os
+import numpy as np
+
+
+class LodPyramid:
+    """ Multi-resolution min/max pyramid of a 1-D signal
+
+        Level 0 is the signal itself, every next level keeps the minimum and
+        the maximum of `factor` consecutive bins of the previous one.
+    """
+
+    def __init__(self, levels, factor):
+        self.levels = levels  # list of (mins, maxs)
+        self.factor = factor
+
+    @classmethod
+    def build(cls, data, factor=8, minLength=1024):
+        levels = [(data, data)]
+        mins, maxs = data, data
+        while len(mins) > minLength:
+            n = len(mins) // factor * factor
+            newMins = np.asarray(mins[:n]).reshape(-1, factor).min(axis=1)
+            newMaxs = np.asarray(maxs[:n]).reshape(-1, factor).max(axis=1)
+            if n < len(mins):  # incomplete last bin
+                newMins = np.append(newMins, np.min(mins[n:]))
+                newMaxs = np.append(newMaxs, np.max(maxs[n:]))
+            mins, maxs = newMins, newMaxs
+            levels.append((mins, maxs))
+        return cls(levels, factor)
+
+    @classmethod
+    def load(cls, data, path, name, factor=8, minLength=1024):
+        """ Loads the levels cached in `path`, rebuilding them if they are missing or outdated """
+        levels = [(data, data)]
+        level = 1
+        expected = len(data)
+        while expected > minLength:
+            expected = -(-expected // factor)
+            fileName = os.path.join(path, '%s_lod%d.npy' % (name, level))
+            if not os.path.exists(fileName):
+                break
+            stored = np.load(fileName, mmap_mode='r')
+            if stored.shape[1] != expected:
+                break
+            levels.append((stored[0], stored[1]))
+            level += 1
+        else:
+            return cls(levels, factor)
+
+        pyramid = cls.build(data, factor, minLength)
+        pyramid.save(path, name)
+        return pyramid
+
+    def save(self, path, name):
+        for level in range(1, len(self.levels)):
+            np.save(os.path.join(path, '%s_lod%d.npy' % (name, level)), np.vstack(self.levels[level]))
+
+    def select(self, first, last, pixels):
+        """ Returns sample numbers and values of the [first, last) range at screen resolution
+
+            For coarse levels every bin gives two points (min, max), so the
+            curve drawn through them covers the whole amplitude range of the bin.
+        """
+        first = max(int(first), 0)
+        last = min(int(last), len(self.levels[0][0]))
+        if last <= first:
+            return np.empty(0, dtype=int), np.empty(0)
+
+        level = 0
+        while level + 1 < len(self.levels) and (last - first) / self.factor ** level > pixels:
+            level += 1
+        binSize = self.factor ** level
+        begin = first // binSize
+        end = -(-last // binSize)
+        mins, maxs = self.levels[level]
+
+        if level == 0:
+            return np.arange(begin, end), np.asarray(mins[begin:end])
+
+        samples = np.repeat(np.arange(begin, end) * binSize, 2)
+        values = np.empty(2 * (end - begin), dtype=np.result_type(mins.dtype, np.float32))
+        values[0::2] = mins[begin:end]
+        values[1::2] = maxs[begin:end]
+        return samples, values
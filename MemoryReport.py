@@ -0,0 +1,56 @@
+import os
+import tracemalloc
+
+projectDir = os.path.dirname(os.path.abspath(__file__))
+
+
+def start_tracing(frames=1):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def subsystem(fileName):
+    """ Module of this project or top-level package the allocation belongs to """
+    fileName = os.path.abspath(fileName)
+    if os.path.dirname(fileName) == projectDir:
+        return os.path.splitext(os.path.basename(fileName))[0]
+    parts = fileName.split(os.sep)
+    for marker in ('site-packages', 'dist-packages'):
+        if marker in parts and parts.index(marker) + 1 < len(parts):
+            return parts[parts.index(marker) + 1]
+    return 'python'
+
+
+def memory_report(sizes=None, limit=12):
+    """ Returns report lines: traced allocations per subsystem and the sizes of known buffers
+
+        The first call only starts tracing unless it was started at launch,
+        allocations made before that are not seen by tracemalloc.
+    """
+    lines = []
+    if sizes:
+        lines.append("Buffers:")
+        for name, size in sizes.items():
+            lines.append("  %-28s %10.1f KiB" % (name, size / 1024))
+
+    if not tracemalloc.is_tracing():
+        start_tracing()
+        lines.append("Allocation tracing started, request the report again to see it")
+        return lines
+
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen *>'),
+        tracemalloc.Filter(False, '<unknown>')))
+
+    totals = {}
+    for stat in snapshot.statistics('filename'):
+        name = subsystem(stat.traceback[0].filename)
+        size, count = totals.get(name, (0, 0))
+        totals[name] = (size + stat.size, count + stat.count)
+
+    current, peak = tracemalloc.get_traced_memory()
+    lines.append("Traced allocations: %.1f KiB, peak %.1f KiB" % (current / 1024, peak / 1024))
+    for name, (size, count) in sorted(totals.items(), key=lambda item: -item[1][0])[:limit]:
+        lines.append("  %-28s %10.1f KiB %8d blocks" % (name, size / 1024, count))
+    return lines
@@ -0,0 +1,73 @@
+import sys
+import time
+import numpy as np
+
+from BreathingRateCounter import breath_rate_counter
+
+
+def run_interval(a_ch0, a_ch1, t_interval, settings, dtype):
+    a_ch0 = np.array(a_ch0, dtype=dtype)
+    a_ch1 = np.array(a_ch1, dtype=dtype)
+    a_ch0 /= 8000
+    a_ch1 /= 8000
+    start = time.perf_counter()
+    result = breath_rate_counter(a_ch0, a_ch1, t_interval, *settings, dtype=dtype)
+    return result, time.perf_counter() - start
+
+
+def precision_report(fileName, t_interval=60, settings=(0.7, 2.5, 0.01, 0.4), fs=50):
+    """ Compares float32 and float64 processing of a recorded session
+
+        :returns:
+            A list of per-interval dicts with HR/BR differences,
+            relative error of the filtered signals and timings
+    """
+    rad = np.load(fileName)
+    a_ch0 = rad["ch0"]
+    a_ch1 = rad["ch1"]
+    step = t_interval * fs
+
+    rows = []
+    for begin in range(0, len(a_ch0) - step + 1, step):
+        ch0 = a_ch0[begin:begin + step]
+        ch1 = a_ch1[begin:begin + step]
+        ref, time64 = run_interval(ch0, ch1, t_interval, settings, np.float64)
+        res, time32 = run_interval(ch0, ch1, t_interval, settings, np.float32)
+
+        signalError = 0
+        for i in (2, 3, 6, 7):  # filtered heart and breath signals
+            norm = max(np.max(np.abs(ref[i])), np.finfo(np.float64).tiny)
+            signalError = max(signalError, np.max(np.abs(ref[i] - res[i])) / norm)
+
+        peaksMismatch = sum(len(np.setxor1d(ref[i], res[i])) for i in (4, 5, 8, 9))
+
+        rows.append({'begin': begin / fs,
+                     'hr_diff': abs(ref[0] - res[0]),
+                     'br_diff': abs(ref[1] - res[1]),
+                     'signal_error': signalError,
+                     'peaks_mismatch': peaksMismatch,
+                     'time64': time64,
+                     'time32': time32})
+    return rows
+
+
+def print_report(fileName, rows):
+    print(fileName)
+    print("%8s %8s %8s %12s %6s %9s %9s" %
+          ('begin,s', 'dHR', 'dBR', 'sig.err', 'peaks', 't64,ms', 't32,ms'))
+    for row in rows:
+        print("%8.0f %8.2f %8.2f %12.2e %6d %9.2f %9.2f" %
+              (row['begin'], row['hr_diff'], row['br_diff'], row['signal_error'],
+               row['peaks_mismatch'], row['time64'] * 1000, row['time32'] * 1000))
+    if rows:
+        print("max dHR = %.2f, max dBR = %.2f, max signal error = %.2e, speedup = %.2f" %
+              (max(r['hr_diff'] for r in rows), max(r['br_diff'] for r in rows),
+               max(r['signal_error'] for r in rows),
+               sum(r['time64'] for r in rows) / sum(r['time32'] for r in rows)))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python PrecisionReport.py session.npz [session2.npz ...]")
+    for fileName in sys.argv[1:]:
+        print_report(fileName, precision_report(fileName))
@@ -0,0 +1,212 @@
+""" Golden-dataset regression harness
+
+    Runs every session of golden/catalogue.json (synthetic signals and stored
+    .npz recordings) through the processing pipeline interval by interval,
+    compares HR/BR with golden/reference.json. A recording is a file saved by
+    the main window, put under golden/ and listed as {"type": "recording",
+    "path": ...}; none is stored yet, all current cases are synthetic. Cases with "peak_check" also
+    compare the peak counts with scipy find_peaks on the same filtered signals,
+    cases with "known_deviation" are printed with the note why their reference
+    differs from the synthetic truth. Exits with status 1 on accuracy drift.
+
+    With --timing the time of every stage is checked too. Times are stored in
+    units of a calibration kernel timed in the same process, so the check
+    compares the pipeline with the machine it runs on rather than wall clock.
+
+        python RegressionHarness.py            check accuracy against the reference
+        python RegressionHarness.py --timing   check accuracy and slowdown of every stage
+        python RegressionHarness.py --update   store the current results as the reference
+"""
+
+import os
+import sys
+import json
+import argparse
+import numpy as np
+from time import perf_counter
+from scipy.signal import butter, find_peaks, sosfiltfilt
+
+from BreathingRateCounter import ArcDemodulator, breath_rate_counter, create_trackers, fsB
+
+goldenDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+settings = (0.7, 2.5, 0.01, 0.4)
+
+
+def calibrate(repeats=10):
+    """ Best time of a fixed filtering and FFT kernel, the unit of the stored stage times """
+    signals = np.random.default_rng(0).normal(size=(2, 60 * fsB))
+    sos = butter(4, (0.7, 2.5), 'bandpass', fs=fsB, output='sos')
+    best = None
+    for repeat in range(repeats):
+        start = perf_counter()
+        for i in range(10):
+            np.fft.rfft(sosfiltfilt(sos, signals, axis=-1), axis=-1)
+        duration = perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def synthetic_session(case):
+    """ Deterministic I/Q pair of a subject with linearly changing breath and heart rates
+
+        "radius" and "centre" set the circle of the I/Q motion in ADC counts,
+        "phase_drift" a slow drift of the phase in rad/min, "iq_noise" the
+        additive noise of both channels in ADC counts.
+    """
+    rng = np.random.default_rng(case['seed'])
+    n = int(case['minutes'] * 60 * fsB)
+    breath = np.linspace(case['breath'][0], case['breath'][1], n)
+    heart = np.linspace(case['heart'][0], case['heart'][1], n)
+    phase = case.get('breath_depth', 0.6) * np.sin(2 * np.pi * np.cumsum(breath) / fsB) + \
+        case.get('heart_depth', 0.15) * np.sin(2 * np.pi * np.cumsum(heart) / fsB) + \
+        case['noise'] * rng.normal(size=n) + case.get('phase_drift', 0) * np.arange(n) / (60 * fsB)
+    offset = np.zeros(n)
+    for position in rng.integers(0, n, case.get('steps', 0)):  # shifts of the body
+        offset[position:] += rng.uniform(-150, 150)
+    for position in rng.integers(0, n - 3 * fsB, case.get('movements', 0)):  # 3 s body movements
+        phase[position:] += np.cumsum(rng.normal(0, 0.3, 3 * fsB))[np.minimum(np.arange(n - position), 3 * fsB - 1)]
+    radius, centre = case.get('radius', 400), case.get('centre', 2000)
+    noise = case.get('iq_noise', 0) * rng.normal(size=(2, n))
+    a_ch0 = np.clip(np.rint(centre + offset + radius * np.cos(phase + 0.5) + noise[0]), 0, 65535).astype(np.uint16)
+    a_ch1 = np.clip(np.rint(centre + offset + radius * np.sin(phase + 0.5) + noise[1]), 0, 65535).astype(np.uint16)
+    return a_ch0, a_ch1
+
+
+def load_session(case):
+    if case['type'] == 'synthetic':
+        return synthetic_session(case)
+    rad = np.load(os.path.join(goldenDir, case['path']))
+    return rad["ch0"], rad["ch1"]
+
+
+def run_case(case, repeats=3):
+    """ Returns per-interval HR/BR and the best of `repeats` total time of every stage
+
+        Cases with "demodulation": "arc" process the phase of the arc demodulator,
+        which is updated with every second of the session as the readers do with blocks.
+    """
+    a_ch0, a_ch1 = load_session(case)
+    step = case['interval'] * fsB
+    best = None
+    for repeat in range(repeats):
+        trackers = create_trackers()
+        demodulator = ArcDemodulator() if case.get('demodulation') == 'arc' else None
+        hr, br = [], []
+        times = {}
+        for begin in range(0, len(a_ch0) - step + 1, step):
+            details = {}
+            i, q = a_ch0[begin:begin + step] / 8000, a_ch1[begin:begin + step] / 8000
+            if demodulator is not None:
+                for block in range(0, step, fsB):
+                    demodulator.update(i[block:block + fsB], q[block:block + fsB])
+            result = breath_rate_counter(i, q, case['interval'], *settings, trackers=trackers, details=details,
+                                         demodulator=demodulator)
+            hr.append(float(result[0]))
+            br.append(float(result[1]))
+            for stage, duration in details['stage_times'].items():
+                times[stage] = times.get(stage, 0) + duration
+        best = times if best is None else {stage: min(best[stage], times[stage]) for stage in times}
+    return {'hr': hr, 'br': br}, best
+
+
+def check_peaks(case, tolerance):
+    """ Intervals where the pipeline finds fewer peaks than find_peaks(distance) on the same filtered signals
+
+        The pipeline may reject ripples find_peaks counts, but must not lose the
+        peaks it finds, so only a shortfall of more than `tolerance` peaks fails.
+    """
+    a_ch0, a_ch1 = load_session(case)
+    step = case['interval'] * fsB
+    trackers = create_trackers()
+    failures = []
+    for number, begin in enumerate(range(0, len(a_ch0) - step + 1, step)):
+        result = breath_rate_counter(a_ch0[begin:begin + step] / 8000, a_ch1[begin:begin + step] / 8000,
+                                     case['interval'], *settings, trackers=trackers, artifacts=False)
+        for band, high, signals, peaks in (('heart', settings[1], result[2:4], result[4:6]),
+                                           ('breath', settings[3], result[6:8], result[8:10])):
+            for channel, (signal, found) in enumerate(zip(signals, peaks)):
+                expected = len(find_peaks(signal, distance=fsB / high)[0])
+                if len(found) < expected - tolerance:
+                    failures.append("%s: %s peaks of channel %d in interval %d: %d, find_peaks %d" %
+                                    (case['name'], band, channel, number, len(found), expected))
+    return failures
+
+
+def compare(name, result, reference, tolerance):
+    failures = []
+    for key in ('hr', 'br'):
+        expected = np.array(reference[key])
+        actual = np.array(result[key])
+        if expected.shape != actual.shape:
+            failures.append("%s: %s has %d intervals, reference %d" % (name, key, len(actual), len(expected)))
+            continue
+        drift = np.abs(actual - expected)
+        if np.any(drift > tolerance[key]):
+            worst = int(np.argmax(drift))
+            failures.append("%s: %s drift %.2f in interval %d (%.2f, reference %.2f)" %
+                            (name, key, drift[worst], worst, actual[worst], expected[worst]))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Accuracy and speed regression check of the pipeline")
+    parser.add_argument('--update', action='store_true', help="store the current results as the reference")
+    parser.add_argument('--timing', action='store_true', help="check the slowdown of every stage too")
+    parser.add_argument('--cases', default='', help="comma-separated case names")
+    args = parser.parse_args(argv)
+
+    with open(os.path.join(goldenDir, 'catalogue.json')) as file:
+        catalogue = json.load(file)
+    referenceFile = os.path.join(goldenDir, 'reference.json')
+    reference = {'results': {}, 'timing': {}}
+    if os.path.exists(referenceFile):
+        with open(referenceFile) as file:
+            reference = json.load(file)
+
+    selected = set(filter(None, args.cases.split(',')))
+    failures = []
+    unit = calibrate()
+    print("%-18s %8s %8s %10s %10s" % ('case', 'HR', 'BR', 'time, ms', 'ref, ms'))
+    for case in catalogue['cases']:
+        name = case['name']
+        if selected and name not in selected:
+            continue
+        result, times = run_case(case)
+        total = sum(times.values())
+        referenceTotal = sum(reference['timing'].get(name, {}).values()) * unit
+        print("%-18s %8.1f %8.1f %10.1f %10.1f" % (name, np.mean(result['hr']), np.mean(result['br']),
+                                                   total * 1000, referenceTotal * 1000))
+        if 'known_deviation' in case:
+            print("    known deviation: " + case['known_deviation'])
+        if args.update:
+            reference['results'][name] = result
+            reference['timing'][name] = {stage: duration / unit for stage, duration in times.items()}
+            continue
+
+        if case.get('peak_check'):
+            failures += check_peaks(case, catalogue['tolerance']['peaks'])
+        if name not in reference['results']:
+            failures.append("%s: no reference results, run with --update" % name)
+            continue
+        failures += compare(name, result, reference['results'][name], catalogue['tolerance'])
+        if args.timing:
+            for stage, duration in times.items():
+                expected = reference['timing'][name].get(stage, 0) * unit
+                if expected and duration > catalogue['slowdown'] * expected:
+                    failures.append("%s: stage %s takes %.1f ms, reference %.1f ms" %
+                                    (name, stage, duration * 1000, expected * 1000))
+
+    if args.update:
+        with open(referenceFile, 'w') as file:
+            json.dump(reference, file, indent=1)
+        print("Reference updated: " + referenceFile)
+        return 0
+
+    for failure in failures:
+        print("FAILED " + failure)
+    print("%d failures" % len(failures) if failures else "OK")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+from PyQt5.QtWidgets import QWidget, QHBoxLayout, QVBoxLayout, QPushButton, QLabel, QFileDialog
+from PyQt5.QtCore import *
+from PyQt5.QtGui import QColor
+
+import os
+import numpy as np
+import pyqtgraph as pg
+
+from SessionStore import SessionReader
+from BreathingRateCounter import ArcDemodulator, breath_rate_counter
+
+
+class ReviewWidget(QWidget):
+    """ Review of a saved session: raw I/Q, filtered signals and HR/BR trends
+
+        Only the visible time range is loaded into the curves, at screen
+        resolution, using the min/max pyramids of the session.
+    """
+    maxFilteredSpan = 300  # s, filtered signals are computed for shorter ranges only
+    minFilteredSpan = 10
+
+    def __init__(self, settingsWidget, parent=None):
+        super(self.__class__, self).__init__(parent)
+
+        self.settingsWidget = settingsWidget
+        self.reader = None
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(layout)
+
+        buttonsLayout = QHBoxLayout()
+        layout.addLayout(buttonsLayout)
+        openButton = QPushButton('Open session')
+        openButton.clicked.connect(self.onOpenButtonClicked)
+        buttonsLayout.addWidget(openButton)
+        self.sessionLabel = QLabel('')
+        self.sessionLabel.setObjectName('secondary')
+        buttonsLayout.addWidget(self.sessionLabel)
+        buttonsLayout.addStretch()
+
+        self.graphics = pg.GraphicsLayoutWidget()
+        layout.addWidget(self.graphics)
+
+        pens = [pg.mkPen(QColor('#5961FF'), width=1), pg.mkPen(QColor('#FF1776'), width=1)]
+
+        self.rawPlot = self.graphics.addPlot(row=0, col=0, title='I/Q')
+        self.filteredPlot = self.graphics.addPlot(row=1, col=0, title='Heart / breath')
+        self.trendPlot = self.graphics.addPlot(row=2, col=0, title='HBR / BR')
+        for plot in (self.filteredPlot, self.trendPlot):
+            plot.setXLink(self.rawPlot)
+        self.trendPlot.setLabel('bottom', 's')
+
+        self.rawCurves = []
+        self.filteredCurves = []
+        self.trendCurves = []
+        for i in range(2):
+            self.rawCurves.append(pg.PlotCurveItem(pen=pens[i]))
+            self.filteredCurves.append(pg.PlotCurveItem(pen=pens[i]))
+            self.trendCurves.append(pg.PlotCurveItem(pen=pens[i]))
+            self.rawPlot.addItem(self.rawCurves[i])
+            self.filteredPlot.addItem(self.filteredCurves[i])
+            self.trendPlot.addItem(self.trendCurves[i])
+
+        # pan and zoom produce many range changes, the curves are reloaded once they settle
+        self.updateTimer = QTimer()
+        self.updateTimer.setSingleShot(True)
+        self.updateTimer.setInterval(30)
+        self.updateTimer.timeout.connect(self.updateVisibleRange)
+        self.rawPlot.sigXRangeChanged.connect(self.updateTimer.start)
+
+    @pyqtSlot()
+    def onOpenButtonClicked(self):
+        path = QFileDialog.getExistingDirectory(self, "Open session", QDir(".").canonicalPath())
+        if path:
+            self.openSession(path)
+
+    def openSession(self, path):
+        if not os.path.exists(os.path.join(path, 'meta.json')):
+            print("Not a session directory: " + path)
+            return
+        self.reader = SessionReader(path)
+        self.sessionLabel.setText(os.path.basename(path))
+
+        T, hr, br = self.reader.results()
+        self.trendCurves[0].setData(T / 1000, hr)
+        self.trendCurves[1].setData(T / 1000, br)
+
+        T_first, T_last = self.reader.timeRange()
+        self.rawPlot.setXRange(T_first / 1000, T_last / 1000, padding=0)
+        self.updateVisibleRange()
+
+    def sampleTimes(self, samples):
+        return self.reader.samples['T'][samples] / 1000
+
+    @pyqtSlot()
+    def updateVisibleRange(self):
+        if self.reader is None or len(self.reader) == 0:
+            return
+        xMin, xMax = self.rawPlot.vb.viewRange()[0]
+        first, last = self.reader.sampleRange(xMin * 1000, xMax * 1000)
+        last = min(last + 1, len(self.reader))
+        pixels = max(int(self.rawPlot.vb.width()), 100)
+
+        for i, channel in enumerate(('ch0', 'ch1')):
+            samples, values = self.reader.pyramid(channel).select(first, last, pixels)
+            self.rawCurves[i].setData(self.sampleTimes(samples), values)
+
+        self.updateFiltered(first, last, pixels)
+
+    def updateFiltered(self, first, last, pixels):
+        span = (last - first) / self.reader.fs
+        if span > self.maxFilteredSpan or span < self.minFilteredSpan:
+            for curve in self.filteredCurves:
+                curve.setData([], [])
+            return
+
+        a_ch0, a_ch1, T = self.reader.read(self.reader.samples['T'][first],
+                                           self.reader.samples['T'][last - 1] + 1)
+        lhf, hhf, lbf, hbf = self.settingsWidget.getValues()
+        a_ch0 = np.asarray(a_ch0) / 8000
+        a_ch1 = np.asarray(a_ch1) / 8000
+        demodulator = None
+        if self.settingsWidget.getProfile().demodulation == 'arc':
+            demodulator = ArcDemodulator()  # the arc of the visible range only
+            demodulator.update(a_ch0, a_ch1)
+        try:
+            result = breath_rate_counter(a_ch0, a_ch1, span, lhf, hhf, lbf, hbf, demodulator=demodulator)
+        except Exception as e:
+            print("Cannot process the selected range: " + str(e))
+            return
+
+        step = max(len(T) // pixels, 1)
+        times = T[::step] / 1000
+        self.filteredCurves[0].setData(times, result[2][::step])  # heart
+        self.filteredCurves[1].setData(times, result[6][::step])  # breath
@@ -0,0 +1,220 @@
+""" Headless acquisition service
+
+    Reads the radar from a serial port (or pty), computes HR/BR every
+    calculation interval, checks alarms on every block of samples and
+    publishes the results as newline-delimited JSON to any number of local
+    TCP / Unix socket subscribers:
+
+        {"type": "rate", "T": 60000, "hr": 72.0, "br": 15.0, "coverage": 0.95}
+        {"type": "event", "T": 81500, "event": "apnea", "active": true, "value": 20.0}
+        {"type": "raw", "T": [...], "ch0": [...], "ch1": [...]}   only after "raw on"
+        {"type": "dropped", "count": 12}                            subscriber was too slow
+
+    Subscribers may send "raw on" / "raw off" lines to toggle raw frames.
+
+        python RythmDaemon.py --port /dev/ttyUSB0 --interval 60 --tcp 127.0.0.1:8765
+"""
+
+import os
+import sys
+import json
+import asyncio
+import argparse
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from FrameDecoder import FrameDecoder, SyncFrameDecoder, IntervalBuffer
+from BreathingRateCounter import ArcDemodulator, breath_rate_counter, create_trackers, demodulations, fsB
+from EventDetector import EventDetector
+
+try:
+    import serial_asyncio
+except ImportError:
+    serial_asyncio = None
+
+
+class Subscriber:
+    def __init__(self, writer, queueSize):
+        self.writer = writer
+        self.queue = asyncio.Queue(queueSize)
+        self.raw = False
+        self.dropped = 0
+
+    def put(self, line):
+        # a slow subscriber loses its oldest messages instead of slowing everybody down
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(line)
+
+    async def send(self):
+        while True:
+            line = await self.queue.get()
+            if self.dropped:
+                self.writer.write(encode({'type': 'dropped', 'count': self.dropped}))
+                self.dropped = 0
+            self.writer.write(line)
+            await self.writer.drain()
+
+
+def encode(message):
+    return (json.dumps(message) + '\n').encode()
+
+
+class Publisher:
+    def __init__(self, queueSize=256):
+        self.queueSize = queueSize
+        self.subscribers = set()
+
+    def publish(self, message, raw=False):
+        if not self.subscribers:
+            return
+        line = encode(message)
+        for subscriber in self.subscribers:
+            if subscriber.raw or not raw:
+                subscriber.put(line)
+
+    async def handleClient(self, reader, writer):
+        subscriber = Subscriber(writer, self.queueSize)
+        self.subscribers.add(subscriber)
+        sender = asyncio.ensure_future(subscriber.send())
+        try:
+            while not sender.done():
+                command = await reader.readline()
+                if not command:
+                    break
+                command = command.decode(errors='ignore').strip()
+                if command == 'raw on':
+                    subscriber.raw = True
+                elif command == 'raw off':
+                    subscriber.raw = False
+        except ConnectionError:
+            pass
+        finally:
+            self.subscribers.discard(subscriber)
+            sender.cancel()
+            writer.close()
+
+
+class AcquisitionDaemon:
+    def __init__(self, args):
+        self.args = args
+        self.decoder = SyncFrameDecoder() if args.framed else FrameDecoder()
+        self.intervalBuffer = IntervalBuffer(args.interval * 1000)
+        self.publisher = Publisher(args.queue)
+        self.settings = (args.lhf, args.hhf, args.lbf, args.hbf)
+        self.executor = ThreadPoolExecutor(1)  # one worker keeps the results in order
+        self.trackers = create_trackers()
+        self.demodulator = ArcDemodulator() if args.demodulation == 'arc' else None
+        self.eventDetector = EventDetector(self.settings, args.apnea, args.brady, args.tachy,
+                                           demodulator=self.demodulator)
+
+    async def openPort(self):
+        if serial_asyncio is not None:
+            return await serial_asyncio.open_serial_connection(url=self.args.port, baudrate=self.args.baud)
+
+        # fallback without pyserial-asyncio: raw tty / pty file descriptor
+        import tty
+        fd = os.open(self.args.port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        if os.isatty(fd):
+            tty.setraw(fd)
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, 'rb', 0))
+        writer = PortWriter(fd)
+        return reader, writer
+
+    async def startServers(self):
+        servers = []
+        if self.args.tcp:
+            host, port = self.args.tcp.rsplit(':', 1)
+            servers.append(await asyncio.start_server(self.publisher.handleClient, host, int(port)))
+            print("Publishing on tcp://" + self.args.tcp)
+        if self.args.unix:
+            servers.append(await asyncio.start_unix_server(self.publisher.handleClient, self.args.unix))
+            print("Publishing on unix://" + self.args.unix)
+        return servers
+
+    async def run(self):
+        servers = await self.startServers()
+        reader, writer = await self.openPort()
+
+        await asyncio.sleep(2)  # the device needs time after the port is opened
+        writer.write(b'5')
+        print("Registration started")
+
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                a_ch0, a_ch1, T_meas = self.decoder.feed(data)
+                if len(T_meas) == 0:
+                    continue
+                self.publisher.publish({'type': 'raw', 'T': T_meas.tolist(),
+                                        'ch0': a_ch0.tolist(), 'ch1': a_ch1.tolist()}, raw=True)
+                for event in self.eventDetector.feed(a_ch0, a_ch1, T_meas):
+                    print(event.message())
+                    self.publisher.publish(event.toDict())
+                if self.demodulator is not None and 'signal_loss' not in self.eventDetector.active:
+                    self.demodulator.update(a_ch0 / 8000, a_ch1 / 8000)  # a lost signal is not a point of the arc
+                for interval in self.intervalBuffer.append(a_ch0, a_ch1, T_meas):
+                    # processing runs in a worker thread, reading continues meanwhile
+                    loop.run_in_executor(self.executor, self.processInterval, loop, *interval)
+        finally:
+            writer.write(b'0')
+            for server in servers:
+                server.close()
+            print("Registration finished")
+
+    def processInterval(self, loop, a_ch0, a_ch1, T_meas):
+        details = {}
+        try:
+            # frames of long gaps are missing, the interval covers only the time of its samples
+            hr, br = breath_rate_counter(np.array(a_ch0) / 8000, np.array(a_ch1) / 8000,
+                                         len(a_ch0) / fsB, *self.settings, trackers=self.trackers,
+                                         details=details, demodulator=self.demodulator)[:2]
+        except Exception as e:
+            print("Processing failed: " + str(e), file=sys.stderr)
+            hr, br = 0, 0
+        message = {'type': 'rate', 'T': int(T_meas[-1]), 'hr': float(hr), 'br': float(br),
+                   'coverage': float(details.get('coverage', 0))}
+        loop.call_soon_threadsafe(self.publisher.publish, message)
+
+
+class PortWriter:
+    def __init__(self, fd):
+        self.fd = fd
+
+    def write(self, data):
+        os.write(self.fd, data)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Headless HR/BR acquisition service")
+    parser.add_argument('--port', required=True, help="serial port or pty")
+    parser.add_argument('--baud', type=int, default=34800)
+    parser.add_argument('--framed', action='store_true', help="framed protocol with sync word and checksum")
+    parser.add_argument('--interval', type=int, default=60, help="calculation interval, s")
+    parser.add_argument('--tcp', default='127.0.0.1:8765', help="host:port, empty to disable")
+    parser.add_argument('--unix', default='', help="unix socket path")
+    parser.add_argument('--queue', type=int, default=256, help="messages buffered per subscriber")
+    parser.add_argument('--lhf', type=float, default=0.7)
+    parser.add_argument('--hhf', type=float, default=2.5)
+    parser.add_argument('--lbf', type=float, default=0.01)
+    parser.add_argument('--hbf', type=float, default=0.4)
+    parser.add_argument('--demodulation', choices=demodulations, default='quadrature',
+                        help="process the phase of the I/Q arc or both channels")
+    parser.add_argument('--apnea', type=float, default=20, help="apnea alarm after s without a breath")
+    parser.add_argument('--brady', type=float, default=50, help="bradycardia alarm below, beats/min")
+    parser.add_argument('--tachy', type=float, default=120, help="tachycardia alarm above, beats/min")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    daemon = AcquisitionDaemon(parse_args())
+    try:
+        asyncio.run(daemon.run())
+    except KeyboardInterrupt:
+        pass
@@ -1,11 +1,12 @@
 from PyQt5 import QtCore
 from PyQt5.QtCore import *
 from PyQt5.QtSerialPort import *
-from struct import unpack
+from FrameDecoder import FrameDecoder, SyncFrameDecoder, IntervalBuffer
 import time
 
 class SerialPortReader(QtCore.QObject):
-    dataReady = pyqtSignal(list, list, list)
+    dataReady = pyqtSignal(object, object, object)
+    blockReady = pyqtSignal(object, object, object)
     locatorPacket = pyqtSignal(float, float)
     timeUpdate = pyqtSignal(int)
 
@@ -15,8 +16,10 @@ class SerialPortReader(QtCore.QObject):
         self.timer = QTimer()
         self.timer.timeout.connect(self.continueListen)
 
-        self.fullReset()
         self.dt_ms = 20
+        self.decoder = FrameDecoder(self.dt_ms)
+        self.intervalBuffer = IntervalBuffer(1000)
+        self.fullReset()
 
         self.port1 = QSerialPort()
         self.port2 = QSerialPort()
@@ -24,10 +27,20 @@ class SerialPortReader(QtCore.QObject):
         self.port1.readyRead.connect(self.OnPortRead)
         self.port2.readyRead.connect(self.OnPortRead)
 
+    def setFramed(self, framed):
+        """ Switches between the plain 4-byte stream and the framed protocol with resync """
+        self.decoder = SyncFrameDecoder(self.dt_ms) if framed else FrameDecoder(self.dt_ms)
+
+    def setInterval(self, dataReadyInterval):
+        """ Changes the interval between dataReady signals without stopping the registration """
+        self.dataReadyInterval = dataReadyInterval * 1000
+        self.intervalBuffer.intervalMs = self.dataReadyInterval
+
     @QtCore.pyqtSlot(int)
     def startListen(self, dataReadyInterval, portName):
         self.fullReset()
         self.dataReadyInterval = dataReadyInterval * 1000
+        self.intervalBuffer = IntervalBuffer(self.dataReadyInterval)
         self.port1.setPortName(portName)
         if self.port1.open(QIODevice.ReadWrite):
             self.port1.setBaudRate(34800)
@@ -47,35 +60,34 @@ class SerialPortReader(QtCore.QObject):
         self.timer.stop()
         self.port1.write(b'0')
         self.port1.close()
+        if isinstance(self.decoder, SyncFrameDecoder) and \
+                (self.decoder.lostFrames or self.decoder.duplicateFrames or self.decoder.resyncs):
+            print("Lost frames: %d, duplicate frames: %d, resyncs: %d, skipped bytes: %d" %
+                  (self.decoder.lostFrames, self.decoder.duplicateFrames, self.decoder.resyncs,
+                   self.decoder.skippedBytes))
         print("Registration finished")
 
     @QtCore.pyqtSlot()
     def OnPortRead(self):
-        # print(self.port1.bytesAvailable(), self.port2.bytesAvailable())
-        while self.port1.bytesAvailable() > 4:
-            a0_mV = (unpack('<H', self.port1.read(2))[0])  # ads voltage = 2 bytes
-            a1_mV = (unpack('<H', self.port1.read(2))[0])
-
-            self.a_ch0.append(a0_mV)
-            self.a_ch1.append(a1_mV)
-
-            self.T_ms += self.dt_ms
-            self.T_meas.append(self.T_ms)
+        a_ch0, a_ch1, T_meas = self.decoder.feed(bytes(self.port1.readAll()))
+        if len(T_meas) == 0:
+            return
+        self.T_ms = self.decoder.T_ms
 
+        for a0_mV, a1_mV in zip(a_ch0.tolist(), a_ch1.tolist()):
             self.locatorPacket.emit(a0_mV, a1_mV)
+        self.blockReady.emit(a_ch0, a_ch1, T_meas)
 
-            if self.T_ms % self.dataReadyInterval == 0:
-                self.dataReady.emit(self.a_ch0, self.a_ch1, self.T_meas)
-                self.reset()
+        for interval in self.intervalBuffer.append(a_ch0, a_ch1, T_meas):
+            self.dataReady.emit(*interval)
 
-            if self.T_ms % 1000 == 0:
-                self.timeUpdate.emit(self.T_ms)
+        for T_ms in T_meas[T_meas % 1000 == 0].tolist():
+            self.timeUpdate.emit(T_ms)
 
     def reset(self):
-        self.a_ch0 = []
-        self.a_ch1 = []
-        self.T_meas = []
+        self.intervalBuffer.reset()
 
     def fullReset(self):
         self.reset()
-        self.T_ms = 0
\ No newline at end of file
+        self.decoder.reset()
+        self.T_ms = 0
@@ -3,11 +3,14 @@ from PyQt5.QtCore import *
 from PyQt5.QtSerialPort import *
 from struct import pack
 import numpy as np
+from FrameDecoder import encode_frames
 
 class SerialPortWriter(QtCore.QObject):
-    def __init__(self):
+    def __init__(self, framed=False):
         super(self.__class__, self).__init__(None)
 
+        self.framed = framed
+
         self.port1 = QSerialPort()
         self.port2 = QSerialPort()
         self.timer = QTimer()
@@ -44,11 +47,15 @@ class SerialPortWriter(QtCore.QObject):
 
     def onTimeout(self):
         index = self.index % len(self.signal1)
-        dataPacked11 = pack("<H", self.signal1[index])
-        dataPacked12 = pack("<H", self.signal2[index])
-
-        self.port1.write(dataPacked11)
-        self.port1.write(dataPacked12)
+        if self.framed:
+            self.port1.write(encode_frames([self.index], self.signal1[index:index + 1],
+                                           self.signal2[index:index + 1]))
+        else:
+            dataPacked11 = pack("<H", self.signal1[index])
+            dataPacked12 = pack("<H", self.signal2[index])
+
+            self.port1.write(dataPacked11)
+            self.port1.write(dataPacked12)
 
         self.index += 1
 
@@ -0,0 +1,176 @@
+""" On-disk session format
+
+    <name>.session/
+        meta.json    - sample rate, block size, format version
+        samples.bin  - raw records (ch0, ch1, T) appended as they arrive
+        index.bin    - one record per fixed-size block: first sample, first and last T
+        results.bin  - computed HR/BR with the time of the interval end
+        ch0_lod*.npy - cached min/max pyramid levels used by the review tab
+"""
+
+import os
+import json
+import numpy as np
+
+from LodPyramid import LodPyramid
+
+SAMPLE_DTYPE = np.dtype([('ch0', '<u2'), ('ch1', '<u2'), ('T', '<u4')])
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('T_first', '<u4'), ('T_last', '<u4')])
+RESULT_DTYPE = np.dtype([('T', '<u4'), ('hr', '<f4'), ('br', '<f4')])
+FORMAT_VERSION = 1
+
+
+def session_path(fileName):
+    if not fileName.endswith('.session'):
+        fileName += '.session'
+    return fileName
+
+
+def unique_session_name(fileName):
+    """ fileName, or fileName-2, fileName-3 ... if a session with that name already exists """
+    name = fileName
+    number = 1
+    while os.path.exists(session_path(name)):
+        number += 1
+        name = "%s-%d" % (fileName, number)
+    return name
+
+
+class SessionWriter:
+    def __init__(self, fileName, fs=50, blockSize=3000):
+        self.path = session_path(fileName)
+        os.makedirs(self.path)  # an existing session is never overwritten
+        self.blockSize = blockSize
+
+        with open(os.path.join(self.path, 'meta.json'), 'w') as file:
+            json.dump({'version': FORMAT_VERSION, 'fs': fs, 'blockSize': blockSize}, file)
+
+        self.samplesFile = open(os.path.join(self.path, 'samples.bin'), 'wb')
+        self.indexFile = open(os.path.join(self.path, 'index.bin'), 'wb')
+        self.resultsFile = open(os.path.join(self.path, 'results.bin'), 'wb')
+
+        self.sampleCount = 0
+        self.blockFirst = None
+        self.blockLast = None
+
+    def append(self, a_ch0, a_ch1, T_meas):
+        records = np.empty(len(T_meas), dtype=SAMPLE_DTYPE)
+        records['ch0'] = a_ch0
+        records['ch1'] = a_ch1
+        records['T'] = T_meas
+
+        # index entries are written every time a block becomes full
+        pos = 0
+        while pos < len(records):
+            blockOffset = self.sampleCount % self.blockSize
+            take = min(self.blockSize - blockOffset, len(records) - pos)
+            if blockOffset == 0:
+                self.blockFirst = records['T'][pos]
+            self.blockLast = records['T'][pos + take - 1]
+            self.sampleCount += take
+            pos += take
+            if self.sampleCount % self.blockSize == 0:
+                self.writeIndexEntry()
+
+        self.samplesFile.write(records.tobytes())
+        self.samplesFile.flush()
+
+    def appendResult(self, T_ms, hr, br):
+        record = np.array([(T_ms, hr, br)], dtype=RESULT_DTYPE)
+        self.resultsFile.write(record.tobytes())
+        self.resultsFile.flush()
+
+    def writeIndexEntry(self):
+        offset = (self.sampleCount - 1) // self.blockSize * self.blockSize
+        entry = np.array([(offset, self.blockFirst, self.blockLast)], dtype=INDEX_DTYPE)
+        self.indexFile.write(entry.tobytes())
+        self.indexFile.flush()
+        self.blockFirst = None
+
+    def close(self):
+        if self.blockFirst is not None:  # last, partially filled block
+            self.writeIndexEntry()
+        self.samplesFile.close()
+        self.indexFile.close()
+        self.resultsFile.close()
+
+
+class SessionReader:
+    def __init__(self, fileName):
+        self.path = session_path(fileName)
+        with open(os.path.join(self.path, 'meta.json')) as file:
+            meta = json.load(file)
+        self.fs = meta['fs']
+        self.blockSize = meta['blockSize']
+        self.refresh()
+
+    def refresh(self):
+        """ Maps the files again, picking up data written since the last call """
+        self.samples = self.mapFile('samples.bin', SAMPLE_DTYPE)
+        self.index = self.mapFile('index.bin', INDEX_DTYPE)
+        self.resultsData = self.mapFile('results.bin', RESULT_DTYPE)
+        self.pyramids = {}
+
+        # blocks written after the last index entry (session still recording or not closed)
+        indexed = 0
+        if len(self.index):
+            indexed = int(self.index['offset'][-1]) + self.blockSize
+        if indexed < len(self.samples):
+            tail = [(offset, self.samples['T'][offset],
+                     self.samples['T'][min(offset + self.blockSize, len(self.samples)) - 1])
+                    for offset in range(indexed, len(self.samples), self.blockSize)]
+            self.index = np.concatenate((self.index, np.array(tail, dtype=INDEX_DTYPE)))
+
+    def mapFile(self, name, dtype):
+        fileName = os.path.join(self.path, name)
+        size = os.path.getsize(fileName) // dtype.itemsize if os.path.exists(fileName) else 0
+        if size == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(fileName, dtype=dtype, mode='r', shape=(size,))
+
+    def __len__(self):
+        return len(self.samples)
+
+    def timeRange(self):
+        if len(self.index) == 0:
+            return 0, 0
+        return int(self.index['T_first'][0]), int(self.index['T_last'][-1])
+
+    def sampleRange(self, T_begin, T_end):
+        """ Returns [first, last) sample numbers covering T_begin <= T < T_end """
+        if len(self.index) == 0:
+            return 0, 0
+        first = self.findSample(T_begin)
+        last = self.findSample(T_end)
+        return first, last
+
+    def findSample(self, T_ms):
+        block = np.searchsorted(self.index['T_last'], T_ms, side='left')
+        if block >= len(self.index):
+            return len(self.samples)
+        offset = int(self.index['offset'][block])
+        blockTimes = self.samples['T'][offset:offset + self.blockSize]
+        return offset + int(np.searchsorted(blockTimes, T_ms, side='left'))
+
+    def read(self, T_begin, T_end):
+        """ Returns ch0, ch1, T for T_begin <= T < T_end as views of the mapped file """
+        first, last = self.sampleRange(T_begin, T_end)
+        records = self.samples[first:last]
+        return records['ch0'], records['ch1'], records['T']
+
+    def pyramid(self, channel):
+        """ Returns the min/max pyramid of 'ch0' or 'ch1', cached next to the samples """
+        if channel not in self.pyramids:
+            self.pyramids[channel] = LodPyramid.load(self.samples[channel], self.path, channel)
+        return self.pyramids[channel]
+
+    def readMinutes(self, begin, end):
+        return self.read(int(begin * 60 * 1000), int(end * 60 * 1000))
+
+    def results(self, T_begin=0, T_end=None):
+        """ Returns T, hr, br of the results computed within the time range """
+        T = self.resultsData['T']
+        first = np.searchsorted(T, T_begin, side='left')
+        last = len(T) if T_end is None else np.searchsorted(T, T_end, side='left')
+        records = self.resultsData[first:last]
+        return records['T'], records['hr'], records['br']
@@ -3,8 +3,13 @@ from PyQt5.QtWidgets import (QDialog, QLabel, QWidget, QGridLayout, QHBoxLayout,
 
 from PyQt5.QtCore import *
 
+from WorkQueue import WorkQueue
+from AnalysisProfile import defaultProfile
+from BreathingRateCounter import demodulations, estimators
+
 class SettingsWidget(QDialog):
     settigsApplied = pyqtSignal(float, float, float, float)
+    profileChanged = pyqtSignal(object)
 
     def __init__(self, parent):
         super(self.__class__, self).__init__(parent)
@@ -27,10 +32,9 @@ class SettingsWidget(QDialog):
         mainLayout.setColumnStretch(1, 0)      # ui
         mainLayout.setColumnStretch(2, 1)      # empty space to the left from ui
 
-        self.lhf = 0.7
-        self.hhf = 2.5
-        self.lbf = 0.01
-        self.hbf = 0.4
+        self.profile = defaultProfile
+        self.precision = 'float64'
+        self.queuePolicy = WorkQueue.DROP_OLDEST
 
         lowHeartFreqLabel = QLabel("Нижняя частота сердечных сокращений")
         self.lowHeartFreqEdit = QLineEdit()
@@ -64,6 +68,30 @@ class SettingsWidget(QDialog):
         self.settingsLayout.addWidget(self.highBreathFreqEdit, 3, 1)
         self.settingsLayout.addWidget(unitsLabel4, 3, 2)
 
+        precisionLabel = QLabel("Точность вычислений")
+        self.precisionBox = QComboBox()
+        self.precisionBox.addItems(['float64', 'float32'])
+        self.settingsLayout.addWidget(precisionLabel, 4, 0)
+        self.settingsLayout.addWidget(self.precisionBox, 4, 1)
+
+        queuePolicyLabel = QLabel("Если обработка не успевает")
+        self.queuePolicyBox = QComboBox()
+        self.queuePolicyBox.addItems(WorkQueue.policies)
+        self.settingsLayout.addWidget(queuePolicyLabel, 5, 0)
+        self.settingsLayout.addWidget(self.queuePolicyBox, 5, 1)
+
+        estimatorLabel = QLabel("Оценка частоты")
+        self.estimatorBox = QComboBox()
+        self.estimatorBox.addItems(estimators)
+        self.settingsLayout.addWidget(estimatorLabel, 6, 0)
+        self.settingsLayout.addWidget(self.estimatorBox, 6, 1)
+
+        demodulationLabel = QLabel("Демодуляция")
+        self.demodulationBox = QComboBox()
+        self.demodulationBox.addItems(demodulations)
+        self.settingsLayout.addWidget(demodulationLabel, 7, 0)
+        self.settingsLayout.addWidget(self.demodulationBox, 7, 1)
+
         buttonsLayout = QHBoxLayout()
 
         okButton = QPushButton('ПРИНЯТЬ')
@@ -74,33 +102,62 @@ class SettingsWidget(QDialog):
         buttonsLayout.addWidget(cancelButton)
         cancelButton.clicked.connect(self.onCancel)
 
-        self.settingsLayout.setRowMinimumHeight(4, 30) # add some space
+        self.settingsLayout.setRowMinimumHeight(8, 30) # add some space
 
-        self.settingsLayout.addLayout(buttonsLayout, 5, 0, 1, 3)
+        self.settingsLayout.addLayout(buttonsLayout, 9, 0, 1, 3)
 
     def setValues(self, lhf, hhf, lbf, hbf):
-        self.lhf = lhf
-        self.hhf = hhf
-        self.lbf = lbf
-        self.hbf = hbf
+        self.setProfile(self.profile.replace(bands=(lhf, hhf, lbf, hbf)))
 
     def getValues(self):
-        return self.lhf, self.hhf, self.lbf, self.hbf
+        return self.profile.bands
+
+    def setProfile(self, profile):
+        """ Makes the profile current, profileChanged is emitted only if it differs """
+        if profile is not self.profile:
+            self.profile = profile
+            self.profileChanged.emit(profile)
+
+    def getProfile(self):
+        return self.profile
+
+    def setPrecision(self, precision):
+        if precision in ('float64', 'float32'):
+            self.precision = precision
+
+    def getPrecision(self):
+        return self.precision
+
+    def setQueuePolicy(self, queuePolicy):
+        if queuePolicy in WorkQueue.policies:
+            self.queuePolicy = queuePolicy
+
+    def getQueuePolicy(self):
+        return self.queuePolicy
 
     def showEvent(self, event):
-        self.lowHeartFreqEdit.setText(str(self.lhf))
-        self.highHeartFreqEdit.setText(str(self.hhf))
-        self.lowBreathFreqEdit.setText(str(self.lbf))
-        self.highBreathFreqEdit.setText(str(self.hbf))
+        lhf, hhf, lbf, hbf = self.profile.bands
+        self.lowHeartFreqEdit.setText(str(lhf))
+        self.highHeartFreqEdit.setText(str(hhf))
+        self.lowBreathFreqEdit.setText(str(lbf))
+        self.highBreathFreqEdit.setText(str(hbf))
+        self.estimatorBox.setCurrentText(self.profile.estimator)
+        self.demodulationBox.setCurrentText(self.profile.demodulation)
+        self.precisionBox.setCurrentText(self.precision)
+        self.queuePolicyBox.setCurrentText(self.queuePolicy)
 
     @pyqtSlot()
     def onOk(self):
-        self.setValues(
+        bands = (
             float(self.lowHeartFreqEdit.text()),
             float(self.highHeartFreqEdit.text()),
             float(self.lowBreathFreqEdit.text()),
             float(self.highBreathFreqEdit.text())
         )
+        self.setProfile(self.profile.replace(bands=bands, estimator=self.estimatorBox.currentText(),
+                                             demodulation=self.demodulationBox.currentText()))
+        self.setPrecision(self.precisionBox.currentText())
+        self.setQueuePolicy(self.queuePolicyBox.currentText())
         self.close()
 
     @pyqtSlot()
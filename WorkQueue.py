@@ -0,0 +1,99 @@
+import time
+import threading
+from collections import deque
+
+
+class WorkQueue:
+    """ Bounded queue of calculation intervals between the GUI and the worker thread
+
+        Policies when the worker falls behind:
+            drop-oldest - keep the newest maxSize intervals
+            coalesce    - keep only the latest interval
+            block       - the producer waits until there is room, but at most blockTimeout
+                          seconds, then the oldest interval is dropped. The producer is
+                          the GUI thread, which also reads the serial port, so an
+                          unbounded wait would hang the UI and lose serial data.
+    """
+    DROP_OLDEST = 'drop-oldest'
+    COALESCE = 'coalesce'
+    BLOCK = 'block'
+    policies = (DROP_OLDEST, COALESCE, BLOCK)
+    blockTimeout = 0.2  # s
+
+    def __init__(self, maxSize=4, policy=DROP_OLDEST):
+        self.condition = threading.Condition()
+        self.items = deque()
+        self.setPolicy(policy, maxSize)
+        self.resetStats()
+
+    def setPolicy(self, policy, maxSize=None):
+        if policy not in self.policies:
+            raise ValueError("Unknown queue policy: " + str(policy))
+        with self.condition:
+            self.policy = policy
+            if maxSize is not None:
+                self.maxSize = max(int(maxSize), 1)
+            self.condition.notify_all()
+
+    def resetStats(self):
+        self.dropped = 0
+        self.processed = 0
+        self.lastLatency = 0
+        self.maxLatency = 0
+        self.totalLatency = 0
+
+    def capacity(self):
+        return 1 if self.policy == self.COALESCE else self.maxSize
+
+    def put(self, item):
+        """ Adds an item stamped with the current time, returns the number of items dropped for it """
+        with self.condition:
+            dropped = 0
+            if self.policy == self.BLOCK:
+                deadline = time.monotonic() + self.blockTimeout
+                while len(self.items) >= self.capacity() and time.monotonic() < deadline:
+                    self.condition.wait(deadline - time.monotonic())
+            while len(self.items) >= self.capacity():
+                self.items.popleft()
+                dropped += 1
+            self.items.append((time.monotonic(), item))
+            self.dropped += dropped
+            self.condition.notify_all()
+            return dropped
+
+    def get(self):
+        """ Returns (enqueue time, item) of the oldest item or None if the queue is empty """
+        with self.condition:
+            if not self.items:
+                return None
+            entry = self.items.popleft()
+            self.condition.notify_all()
+            return entry
+
+    def clear(self):
+        with self.condition:
+            self.items.clear()
+            self.condition.notify_all()
+
+    def depth(self):
+        with self.condition:
+            return len(self.items)
+
+    def memoryUsage(self):
+        with self.condition:
+            return sum(getattr(value, 'nbytes', 0) for _, item in self.items for value in item)
+
+    def recordLatency(self, latency):
+        """ Registers the time from enqueueing an interval to showing its result """
+        with self.condition:
+            self.processed += 1
+            self.lastLatency = latency
+            self.maxLatency = max(self.maxLatency, latency)
+            self.totalLatency += latency
+
+    def stats(self):
+        with self.condition:
+            meanLatency = self.totalLatency / self.processed if self.processed else 0
+            return {'depth': len(self.items), 'dropped': self.dropped, 'processed': self.processed,
+                    'lastLatency': self.lastLatency, 'meanLatency': meanLatency,
+                    'maxLatency': self.maxLatency}
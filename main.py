@@ -11,6 +11,7 @@ from PyQt5.QtWidgets import (QApplication,
                              QMessageBox,
                              QComboBox,
                              QInputDialog,
+                             QShortcut,
                              QTabWidget)
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
@@ -19,52 +20,125 @@ from SerialPortReader import *
 from SerialPortWriter import *
 from ConsoleWidget import ConsoleWidget
 from SettingsWidget import SettingsWidget
+from ReviewWidget import ReviewWidget
 from OutLog import OutLog
 
 import sys
+import time
 import numpy as np
+from array import array
 import pyqtgraph as pg
 
-from BreathingRateCounter import breath_rate_counter
+from BreathingRateCounter import ArcDemodulator, breath_rate_counter, create_trackers, fsB
+from SessionStore import SessionWriter, SessionReader, unique_session_name
+from FrameDecoder import SyncFrameDecoder
+from AnalysisProfile import SlidingWindow, profiles, defaultProfile
+from EventDetector import EventDetector, Event
+from WorkQueue import WorkQueue
+from MemoryReport import memory_report, start_tracing
 from COMReader import serial_ports
 from datetime import datetime
 
 
+class RascanResult:
+    """Results of one calculation interval, passed to the GUI by reference"""
+    __slots__ = ('time', 'registration', 'enqueuedAt', 'heartRate', 'breathRate',
+                 'heartSignals', 'heartPeaks',
+                 'breathSignals', 'breathPeaks',
+                 'heartRateWide', 'heartAmplitude', 'breathAmplitude', 'coverage')
+
+    def __init__(self, heartRate, breathRate, heartSignals, heartPeaks, breathSignals, breathPeaks, time=0):
+        self.time = time
+        self.registration = 0
+        self.enqueuedAt = 0
+        self.heartRate = heartRate
+        self.breathRate = breathRate
+        self.heartSignals = heartSignals
+        self.heartPeaks = heartPeaks
+        self.breathSignals = breathSignals
+        self.breathPeaks = breathPeaks
+        self.heartRateWide = 0
+        self.heartAmplitude = 0
+        self.breathAmplitude = 0
+        self.coverage = 0
+
+    @classmethod
+    def empty(cls, time=0):
+        empty = np.array([])
+        return cls(0, 0, (empty, empty), (empty, empty), (empty, empty), (empty, empty), time)
+
+    def decimate(self, factor):
+        # signals become strided views, peak positions are rescaled without extra copies
+        self.heartSignals = tuple(sig[::factor] for sig in self.heartSignals)
+        self.breathSignals = tuple(sig[::factor] for sig in self.breathSignals)
+        self.heartPeaks = tuple(np.true_divide(peaks, factor) for peaks in self.heartPeaks)
+        self.breathPeaks = tuple(np.true_divide(peaks, factor) for peaks in self.breathPeaks)
+        return self
+
+
 class RascanWorker(QObject):
-    dataProcessed = pyqtSignal(float, float,
-                               np.ndarray, np.ndarray, np.ndarray, np.ndarray,
-                               np.ndarray, np.ndarray, np.ndarray, np.ndarray)
+    dataProcessed = pyqtSignal(object)
+    registrationDrained = pyqtSignal(int)
 
-    def __init__(self, parent=None):
+    def __init__(self, workQueue, demodulator, parent=None):
         super(self.__class__, self).__init__(parent)
+        self.workQueue = workQueue
+        self.demodulator = demodulator  # updated by the main window with every block outside signal loss
+        self.trackers = create_trackers()
+        self.registration = 0
+        self.profile = None
 
-    @QtCore.pyqtSlot(list, list, int, tuple)
-    def doWork(self, a_ch0, a_ch1, t_interval, settings):
+    @QtCore.pyqtSlot()
+    def processQueue(self):
+        entry = self.workQueue.get()
+        while entry is not None:
+            enqueuedAt, work = entry
+            result = self.doWork(*work)
+            result.enqueuedAt = enqueuedAt
+            self.dataProcessed.emit(result)
+            entry = self.workQueue.get()
 
-        a_ch0 = np.array(a_ch0) / 8000
-        a_ch1 = np.array(a_ch1) / 8000
-        lhf, hhf, lbf, hbf = settings
+    @QtCore.pyqtSlot(int)
+    def drainRegistration(self, registration):
+        """ Processes the intervals left in the queue, then reports that the registration has no more results """
+        self.processQueue()
+        self.registrationDrained.emit(registration)
+
+    def doWork(self, a_ch0, a_ch1, profile, precision, t_end, registration):
+        dtype = np.dtype(precision)
+        a_ch0 = np.array(a_ch0, dtype=dtype)
+        a_ch1 = np.array(a_ch1, dtype=dtype)
+        a_ch0 /= 8000
+        a_ch1 /= 8000
+        lhf, hhf, lbf, hbf = profile.bands
+
+        # a new registration or another profile, the previous estimates are not valid
+        if registration != self.registration or profile is not self.profile:
+            for tracker in self.trackers:
+                tracker.reset()
+        self.registration = registration
+        self.profile = profile
 
         try:
+            details = {}
+            # frames of long gaps are missing, the window covers only the time of its samples
             hr, br, sig_hf1, sig_hf2, peaks_hf1, peaks_hf2, \
             sig_bf1, sig_bf2, peaks_bf1, peaks_bf2 = \
-                breath_rate_counter(a_ch0, a_ch1, t_interval, lhf, hhf, lbf, hbf)
+                breath_rate_counter(a_ch0, a_ch1, len(a_ch0) / fsB, lhf, hhf, lbf, hbf, dtype=dtype,
+                                    trackers=self.trackers, details=details,
+                                    cache=profile.cache(precision), estimator=profile.estimator,
+                                    demodulator=self.demodulator if profile.demodulation == 'arc' else None)
+            result = RascanResult(hr, br, (sig_hf1, sig_hf2), (peaks_hf1, peaks_hf2),
+                                  (sig_bf1, sig_bf2), (peaks_bf1, peaks_bf2), t_end)
+            result.heartRateWide = details['heart_rate_wide']
+            result.heartAmplitude = details['heart_amplitude']
+            result.breathAmplitude = details['breath_amplitude']
+            result.coverage = details['coverage']
         except:
-            hr, br, sig_hf1, sig_hf2, peaks_hf1, peaks_hf2, \
-            sig_bf1, sig_bf2, peaks_bf1, peaks_bf2 = \
-                0, 0, 0, 0, 0, 0, 0, 0, 0, 0
-
-        sig_hf1 = sig_hf1[::5]
-        sig_hf2 = sig_hf2[::5]
-        sig_bf1 = sig_bf1[::5]
-        sig_bf2 = sig_bf2[::5]
-        peaks_hf1 = peaks_hf1 / 5
-        peaks_hf2 = peaks_hf2 / 5
-        peaks_bf1 = peaks_bf1 / 5
-        peaks_bf2 = peaks_bf2 / 5
+            result = RascanResult.empty(t_end)
 
-        self.dataProcessed.emit(hr, br, sig_hf1, sig_hf2, peaks_hf1, peaks_hf2,
-                                sig_bf1, sig_bf2, peaks_bf1, peaks_bf2)
+        result.registration = registration
+        return result.decimate(profile.decimation)
 
 
 class MyAxis(pg.AxisItem):
@@ -119,7 +193,7 @@ class PlotWidget(pg.GraphicsWindow):
                                 pg.ScatterPlotItem(pen=self.pens[i])])
             self.plot.addItem(self.curves[i][0])
             self.plot.addItem(self.curves[i][1])
-            self.datas.append([[], []])
+            self.datas.append([np.empty(0), np.empty((0, 2))])
             self.ptrs.append(0)
             self.hides.append(False)
 
@@ -135,7 +209,7 @@ class PlotWidget(pg.GraphicsWindow):
 
     def appendPoint(self, curveNumber, value):
         if len(self.datas[curveNumber][0]) < self.dataSize:
-            self.datas[curveNumber][0].append(value)
+            self.datas[curveNumber][0] = np.append(self.datas[curveNumber][0], value)
         else:
             self.datas[curveNumber][0][:-1] = self.datas[curveNumber][0][1:]
             self.datas[curveNumber][0][-1] = value
@@ -146,42 +220,48 @@ class PlotWidget(pg.GraphicsWindow):
 
     def appendData(self, curveNumber, data, peaks=None):
         if peaks is None:
-            peaks = []
-        delta = self.dataSize - (len(data) + len(self.datas[curveNumber][0]))
-
-        if delta < 0:
-            self.datas[curveNumber][0][:delta] = self.datas[curveNumber][0][-delta:]
-            self.datas[curveNumber][0][delta:] = data
-            self.ptrs[curveNumber] += -delta
+            peaks = np.empty(0)
+        oldData = self.datas[curveNumber][0]
+        delta = len(data) + len(oldData) - self.dataSize
+
+        if delta > 0:
+            # keep only the tail that fits, copying every sample at most once
+            keep = max(len(oldData) - delta, 0)
+            self.datas[curveNumber][0] = np.concatenate((oldData[len(oldData) - keep:],
+                                                         data[len(data) - (self.dataSize - keep):]))
+            self.ptrs[curveNumber] += delta
         else:
-            self.datas[curveNumber][0] += data
+            self.datas[curveNumber][0] = np.concatenate((oldData, data))
         if not self.hides[curveNumber]:
             self.curves[curveNumber][0].setData(self.datas[curveNumber][0])
         self.curves[curveNumber][0].setPos(self.ptrs[curveNumber], 0)
         self.appendPeaks(curveNumber, data, peaks)
 
     def appendPeaks(self, curveNumber, data, peaks):
-        self.datas[curveNumber][1][:] = \
-            [x for x in self.datas[curveNumber][1]
-             if x['pos'][0] >= self.ptrs[curveNumber]]
-        dataBegin = len(self.datas[curveNumber][0]) - len(data) + self.ptrs[curveNumber]
-
-        for index, item in enumerate(peaks):
-            roundedItem = int(item + 0.5)
-            roundedItem = min(roundedItem, len(data) - 1)
-            self.datas[curveNumber][1].append({'pos': (dataBegin + roundedItem, data[roundedItem])})
-        self.curves[curveNumber][1].setData(self.datas[curveNumber][1])
+        # peaks are stored as an (n, 2) array of (x, y) positions
+        allPeaks = self.datas[curveNumber][1]
+        if len(data) != 0 and len(peaks) != 0:
+            dataBegin = len(self.datas[curveNumber][0]) - len(data) + self.ptrs[curveNumber]
+            roundedPeaks = np.minimum((np.asarray(peaks) + 0.5).astype(int), len(data) - 1)
+            newPeaks = np.column_stack((dataBegin + roundedPeaks, data[roundedPeaks]))
+            allPeaks = np.concatenate((allPeaks, newPeaks))
+        allPeaks = allPeaks[allPeaks[:, 0] >= self.ptrs[curveNumber]]
+        self.datas[curveNumber][1] = allPeaks
+        self.curves[curveNumber][1].setData(x=allPeaks[:, 0], y=allPeaks[:, 1])
+
+    def memoryUsage(self):
+        return sum(data[0].nbytes + data[1].nbytes for data in self.datas)
 
     def resetOne(self, curveNumber):
-        self.datas[curveNumber][0] = [0]
+        self.datas[curveNumber][0] = np.zeros(1)
         self.ptrs[curveNumber] = 0
         self.curves[curveNumber][0].setData(self.datas[curveNumber][0])
         self.curves[curveNumber][0].setPos(self.ptrs[curveNumber], 0)
-        self.datas[curveNumber][0] = []
+        self.datas[curveNumber][0] = np.empty(0)
         self.ptrs[curveNumber] = 0
         self.curves[curveNumber][0].setData(self.datas[curveNumber][0])
         self.curves[curveNumber][0].setPos(self.ptrs[curveNumber], 0)
-        self.datas[curveNumber][1] = []
+        self.datas[curveNumber][1] = np.empty((0, 2))
         self.curves[curveNumber][1].clear()
 
     def reset(self):
@@ -192,26 +272,54 @@ class PlotWidget(pg.GraphicsWindow):
 class ExperimentData():
     def __init__(self, parent):
         self.parent = parent
+        self.sessionWriter = None
+        self.memoryBudget = 64 * 1024 * 1024  # bytes kept in memory before spilling to disk
         self.reset()
 
     def appendData(self, a_ch0, a_ch1, T_meas):
-        self.a_ch0 += a_ch0
-        self.a_ch1 += a_ch1
-        self.T_meas += T_meas
+        if self.spillPath is not None:
+            self.sessionWriter.append(a_ch0, a_ch1, T_meas)
+        else:
+            self.a_ch0.frombytes(np.asarray(a_ch0, dtype=np.uint16).tobytes())
+            self.a_ch1.frombytes(np.asarray(a_ch1, dtype=np.uint16).tobytes())
+            self.T_meas.frombytes(np.asarray(T_meas, dtype=np.uint32).tobytes())
+            if self.memoryUsage() > self.memoryBudget:
+                self.spill()
         self.needToSave = True
 
-    def appendDataToTxt(self, a_ch0, a_ch1, T_meas, fileName):
-        with open(str(fileName + '.txt'), 'a') as file:
-            for i in range(0, len(a_ch0)):
-                file.write(str(a_ch0[i]) + ' ' + str(a_ch1[i])
-                           + ' ' + str(T_meas[i]) + '\n')
+    def memoryUsage(self):
+        return sum(len(data) * data.itemsize for data in (self.a_ch0, self.a_ch1, self.T_meas))
+
+    def spill(self):
+        fileName = 'spill-' + str(datetime.today()).split('.')[0].replace(' ', '-').replace(':', '-')
+        self.sessionWriter = SessionWriter(unique_session_name(fileName))
+        self.sessionWriter.append(self.a_ch0, self.a_ch1, self.T_meas)
+        self.spillPath = self.sessionWriter.path
+        self.a_ch0, self.a_ch1, self.T_meas = array('H'), array('H'), array('I')
+        print("Memory budget reached, recording continues in " + self.spillPath)
+
+    def appendDataToSession(self, a_ch0, a_ch1, T_meas, fileName):
+        if self.sessionWriter is None:
+            self.sessionWriter = SessionWriter(fileName)
+        self.sessionWriter.append(a_ch0, a_ch1, T_meas)
         self.needToSave = False
 
+    def appendResult(self, T_ms, hr, br):
+        if self.sessionWriter is not None:
+            self.sessionWriter.appendResult(T_ms, hr, br)
+
+    def closeSession(self):
+        if self.sessionWriter is not None:
+            self.sessionWriter.close()
+            self.sessionWriter = None
+
     def reset(self):
-        self.a_ch0 = []
-        self.a_ch1 = []
-        self.T_meas = []
+        self.a_ch0 = array('H')  # 2 bytes per sample instead of a Python int in a list
+        self.a_ch1 = array('H')
+        self.T_meas = array('I')
         self.needToSave = False
+        self.closeSession()
+        self.spillPath = None
 
     def saveIfNeeded(self):
         if self.needToSave:
@@ -222,13 +330,19 @@ class ExperimentData():
                 self.saveToFile()
 
     def saveToFile(self):
-        if len(self.T_meas) != 0:
+        if len(self.T_meas) != 0 or self.spillPath is not None:
             fileName = QFileDialog.getSaveFileName(None,
                                                    "Save unsaved data to file",
                                                    QDir(".").canonicalPath(),
                                                    "NPZ(*.npz)")
-            np.savez_compressed(fileName[0], ch0=self.a_ch0, ch1=self.a_ch1,
-                                T=self.T_meas)
+            if self.spillPath is not None:
+                reader = SessionReader(self.spillPath)
+                T_first, T_last = reader.timeRange()
+                a_ch0, a_ch1, T_meas = reader.read(T_first, T_last + 1)
+                np.savez_compressed(fileName[0], ch0=a_ch0, ch1=a_ch1, T=T_meas)
+            else:
+                np.savez_compressed(fileName[0], ch0=self.a_ch0, ch1=self.a_ch1,
+                                    T=self.T_meas)
             self.needToSave = False
 
 
@@ -243,13 +357,21 @@ class MyIntValidator(QIntValidator):
 
 
 class MainWindow(QWidget):
-    processData = pyqtSignal(list, list, int, tuple)
+    workQueued = pyqtSignal()
+    registrationStopped = pyqtSignal(int)
 
     def __init__(self):
         super(self.__class__, self).__init__(None)
 
         self.reader = SerialPortReader()
+        self.workQueue = WorkQueue()
         self.experimentData = ExperimentData(self)
+        self.profile = defaultProfile
+        self.slidingWindow = SlidingWindow(self.profile.window * 1000)
+        self.demodulator = ArcDemodulator()
+        self.eventDetector = EventDetector(self.profile.bands)
+        self.sound = True
+        self.registration = 0  # number of the current registration, results of a stopped one are drained
         self.initGUI()
 
         sys.stdout = OutLog(self.console, sys.stdout)
@@ -258,19 +380,96 @@ class MainWindow(QWidget):
         self.createWorkerThread()
         self.reader.timeUpdate.connect(self.onTimeUpdate)
         self.reader.dataReady.connect(self.onDataReady)
+        self.reader.blockReady.connect(self.onBlockReady)
         self.reader.locatorPacket.connect(self.onLocatorPacket)
+        self.settingsWidget.profileChanged.connect(self.onProfileChanged)
         self.loadSettings()
 
-    @QtCore.pyqtSlot(list, list, list)
+        QShortcut(QKeySequence('Ctrl+M'), self, self.printMemoryReport)
+
+    def plotWidgets(self):
+        return {'heart rate plot': self.heartRatePlotWidget,
+                'breath rate plot': self.breathRatePlotWidget,
+                'locator plot': self.locatorPlotWidget,
+                'heart filtered plot': self.heartFilteredPlotWidget,
+                'breath filtered plot': self.breathFilteredPlotWidget}
+
+    @QtCore.pyqtSlot()
+    def printMemoryReport(self):
+        sizes = {'experiment data': self.experimentData.memoryUsage(),
+                 'console text': self.console.document().characterCount() * 2}
+        for name, plotWidget in self.plotWidgets().items():
+            sizes[name] = plotWidget.memoryUsage()
+        sizes['work queue (%d intervals)' % self.workQueue.depth()] = self.workQueue.memoryUsage()
+        print("\n".join(memory_report(sizes)) + "\n")
+
+    @QtCore.pyqtSlot(object, object, object)
     def onDataReady(self, a_ch0, a_ch1, T_meas):
         if self.experimentLength < 5:
             self.experimentData.appendData(a_ch0, a_ch1, T_meas)
         else:
-            self.experimentData.appendDataToTxt(a_ch0, a_ch1,
-                                                T_meas, self.txtFileName)
-        self.processData.emit(a_ch0, a_ch1,
-                              self.intervalLength,
-                              self.settingsWidget.getValues())
+            self.experimentData.appendDataToSession(a_ch0, a_ch1,
+                                                    T_meas, self.sessionFileName)
+        window = self.slidingWindow.append(a_ch0, a_ch1, T_meas)
+        if window is None:
+            return
+        a_ch0, a_ch1, T_meas = window
+        dropped = self.workQueue.put((a_ch0, a_ch1,
+                                      self.profile,
+                                      self.settingsWidget.getPrecision(),
+                                      int(T_meas[-1]),
+                                      self.registration))
+        if dropped:
+            print("Processing is behind real time, skipped intervals: %d" % dropped)
+        self.workQueued.emit()
+
+    @QtCore.pyqtSlot(object, object, object)
+    def onBlockReady(self, a_ch0, a_ch1, T_meas):
+        events = self.eventDetector.feed(a_ch0, a_ch1, T_meas)
+        if 'signal_loss' not in self.eventDetector.active:  # a lost signal is not a point of the arc
+            self.demodulator.update(np.asarray(a_ch0) / 8000, np.asarray(a_ch1) / 8000)
+        if not events:
+            return
+        for event in events:
+            print(event.message())
+        if self.sound and any(event.active for event in events):
+            QApplication.beep()
+        self.alarmLabel.setText(", ".join(sorted(Event.names[kind] for kind in self.eventDetector.active)))
+
+    def applyProfile(self, profile):
+        """ Switches the calculation to the profile, the serial stream is not interrupted
+
+            Caches are prepared before the switch, intervals already in the queue
+            are finished with the profile they were queued with.
+        """
+        profile.prepare(self.settingsWidget.getPrecision())
+        self.slidingWindow.setLength(profile.window * 1000)
+        self.reader.setInterval(profile.hop)
+        self.eventDetector.setBands(profile.bands)
+        self.eventDetector.setDemodulator(self.demodulator if profile.demodulation == 'arc' else None)
+        self.heartRatePlotWidget.setDelta(profile.hop * 1000)
+        self.breathRatePlotWidget.setDelta(profile.hop * 1000)
+        self.profile = profile
+
+    @QtCore.pyqtSlot(object)
+    def onProfileChanged(self, profile):
+        self.profileBox.blockSignals(True)
+        self.profileBox.setCurrentText(profile.name)
+        self.profileBox.blockSignals(False)
+        self.intervalLayoutEdit.setText(str(profile.window))
+        if self.startStopButton.isChecked() and profile is not self.profile:
+            self.applyProfile(profile)
+            print("Profile %s: window %d s, hop %d s, %s, %s" % (profile.name, profile.window, profile.hop,
+                                                                profile.estimator, profile.demodulation))
+
+    @QtCore.pyqtSlot(str)
+    def onProfileSelected(self, name):
+        self.settingsWidget.setProfile(profiles[name])
+
+    @QtCore.pyqtSlot()
+    def onIntervalEdited(self):
+        window = int(self.intervalLayoutEdit.text())
+        self.settingsWidget.setProfile(self.settingsWidget.getProfile().replace(window=window))
 
     @QtCore.pyqtSlot(float, float)
     def onLocatorPacket(self, val1, val2):
@@ -287,12 +486,14 @@ class MainWindow(QWidget):
             self.startStopButton.toggle()
 
     def createWorkerThread(self):
-        self.rascanWorker = RascanWorker()
+        self.rascanWorker = RascanWorker(self.workQueue, self.demodulator)
         self.workerThread = QThread()
         self.rascanWorker.moveToThread(self.workerThread)
         self.workerThread.start()
 
-        self.processData.connect(self.rascanWorker.doWork)
+        self.workQueued.connect(self.rascanWorker.processQueue)
+        self.registrationStopped.connect(self.rascanWorker.drainRegistration)
+        self.rascanWorker.registrationDrained.connect(self.onRegistrationDrained)
         self.rascanWorker.dataProcessed.connect(self.onRascanDataProcessed)
 
     def initGUI(self):
@@ -346,6 +547,7 @@ class MainWindow(QWidget):
         settingsLayout.addWidget(intervalLayoutText, 1, 0)
         settingsLayout.addWidget(self.intervalLayoutEdit, 1, 2)
         settingsLayout.addWidget(imin, 1, 3)
+        self.intervalLayoutEdit.editingFinished.connect(self.onIntervalEdited)
 
         self.comBox = QComboBox(self)
         COMLayoutText = QLabel('Choose COM-port')
@@ -354,8 +556,15 @@ class MainWindow(QWidget):
         settingsLayout.addWidget(COMLayoutText, 2, 0)
         settingsLayout.addWidget(self.comBox, 2, 2)
 
+        self.profileBox = QComboBox(self)
+        profileLayoutText = QLabel('Analysis profile')
+        self.profileBox.addItems(profiles.keys())
+        self.profileBox.activated[str].connect(self.onProfileSelected)
+        settingsLayout.addWidget(profileLayoutText, 3, 0)
+        settingsLayout.addWidget(self.profileBox, 3, 2)
+
         # back to main layout
-        settingsLayout.setRowMinimumHeight(3, 20)  # add some space vertically
+        settingsLayout.setRowMinimumHeight(4, 20)  # add some space vertically
 
         self.saveCheckBox = QCheckBox('Save remainder')
         settingsLayout.addWidget(self.saveCheckBox, 5, 0)
@@ -365,6 +574,16 @@ class MainWindow(QWidget):
         leftLayout.addWidget(self.timeLabel)
         leftLayout.setAlignment(self.timeLabel, Qt.AlignHCenter)
 
+        self.queueLabel = QLabel('')
+        self.queueLabel.setObjectName('secondary')
+        leftLayout.addWidget(self.queueLabel)
+        leftLayout.setAlignment(self.queueLabel, Qt.AlignHCenter)
+
+        self.alarmLabel = QLabel('')
+        self.alarmLabel.setObjectName('alarm')
+        leftLayout.addWidget(self.alarmLabel)
+        leftLayout.setAlignment(self.alarmLabel, Qt.AlignHCenter)
+
         infoLayout = QHBoxLayout()
         infoLayout.setSpacing(20)
         leftLayout.addLayout(infoLayout)
@@ -458,6 +677,10 @@ class MainWindow(QWidget):
         tabThreeLayout.addWidget(self.heartFilteredPlotWidget)
         tabThreeLayout.addWidget(self.breathFilteredPlotWidget)
 
+        # fourth tab
+        self.reviewWidget = ReviewWidget(self.settingsWidget)
+        tabWidget.addTab(self.reviewWidget, "Review")
+
     @QtCore.pyqtSlot(bool)
     def onButtonClick(self, toggled):
         if toggled:
@@ -471,52 +694,75 @@ class MainWindow(QWidget):
             if self.saveCheckBox.isChecked():
                 self.experimentData.saveIfNeeded()
             self.experimentData.reset()
+            self.registration += 1
             self.startStopButton.setText('Stop')
-            self.intervalLength = int(self.intervalLayoutEdit.text())
+            profile = self.settingsWidget.getProfile().replace(window=int(self.intervalLayoutEdit.text()))
             self.experimentLength = int(self.lengthSettingsEdit.text())
-            if self.experimentLength < self.intervalLength / 60:
+            if self.experimentLength < profile.window / 60:
                 print("Error: calculation interval  more than experiment duration")
                 self.startStopButton.setChecked(False)
                 self.startStopButton.setText('Start')
                 return
             if self.experimentLength >= 5:
-                self.txtFileName = str(datetime.today()).split('.')[0].replace(' ', '-').replace(':', '-')[:-3]
+                self.sessionFileName = unique_session_name(
+                    str(datetime.today()).split('.')[0].replace(' ', '-').replace(':', '-'))
+
+            self.workQueue.clear()
+            self.workQueue.setPolicy(self.settingsWidget.getQueuePolicy())
+            self.workQueue.resetStats()
 
             print("Be patient, the program is running...")
-            self.reader.startListen(self.intervalLength, portName)
+            self.slidingWindow.reset()
+            self.demodulator.reset()
+            self.eventDetector.reset()
+            self.reader.startListen(profile.hop, portName)
             self.heartRatePlotWidget.reset()
             self.breathRatePlotWidget.reset()
             self.breathFilteredPlotWidget.reset()
             self.heartFilteredPlotWidget.reset()
             self.locatorPlotWidget.reset()
-            self.heartRatePlotWidget.setDelta(self.intervalLength * 1000)
-            self.breathRatePlotWidget.setDelta(self.intervalLength * 1000)
+            self.applyProfile(profile)
+            self.settingsWidget.setProfile(profile)  # already applied, onProfileChanged only shows it
             self.heartRatePlotWidget.appendPoint(0, 0)
             self.breathRatePlotWidget.appendPoint(0, 0)
+            self.alarmLabel.setText('')
         else:
             self.startStopButton.setText('Start')
             self.reader.stopListen()
+            # the session is closed when the worker has written the result of the last interval
+            self.registrationStopped.emit(self.registration)
+
+    @QtCore.pyqtSlot(int)
+    def onRegistrationDrained(self, registration):
+        if registration == self.registration and not self.startStopButton.isChecked():
+            self.experimentData.closeSession()
 
     @QtCore.pyqtSlot()
     def onSaveButtonClicked(self):
         self.experimentData.saveToFile()
 
-    @QtCore.pyqtSlot(float, float, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray,
-                     np.ndarray)
-    def onRascanDataProcessed(self, chss, chd, sig_hf1, sig_hf2, peaks_hf1, peaks_hf2, sig_bf1, sig_bf2, peaks_bf1,
-                              peaks_bf2):
-        self.heartRateText.setText(str(int(chss)))
-        self.breathRateText.setText(str(int(chd)))
-        self.heartRatePlotWidget.appendPoint(0, chss)
-        self.breathRatePlotWidget.appendPoint(0, chd)
-        self.heartFilteredPlotWidget.appendData(0, sig_hf1.tolist(), peaks_hf1.tolist())
-        self.heartFilteredPlotWidget.appendData(1, sig_hf2.tolist(), peaks_hf2.tolist())
-        self.breathFilteredPlotWidget.appendData(0, sig_bf1.tolist(), peaks_bf1.tolist())
-        self.breathFilteredPlotWidget.appendData(1, sig_bf2.tolist(), peaks_bf2.tolist())
+    @QtCore.pyqtSlot(object)
+    def onRascanDataProcessed(self, result):
+        if result.registration != self.registration:  # computed before the registration was restarted
+            return
+        self.workQueue.recordLatency(time.monotonic() - result.enqueuedAt)
+        stats = self.workQueue.stats()
+        self.queueLabel.setText("queue %d, dropped %d, latency %.1f s (max %.1f s), clean signal %d%%" %
+                                (stats['depth'], stats['dropped'], stats['lastLatency'], stats['maxLatency'],
+                                 result.coverage * 100))
+        self.experimentData.appendResult(result.time, result.heartRate, result.breathRate)
+        self.heartRateText.setText(str(int(result.heartRate)))
+        self.breathRateText.setText(str(int(result.breathRate)))
+        self.heartRatePlotWidget.appendPoint(0, result.heartRate)
+        self.breathRatePlotWidget.appendPoint(0, result.breathRate)
+        for i in range(2):
+            self.heartFilteredPlotWidget.appendData(i, result.heartSignals[i], result.heartPeaks[i])
+            self.breathFilteredPlotWidget.appendData(i, result.breathSignals[i], result.breathPeaks[i])
 
     def closeEvent(self, event):
         if self.saveCheckBox.isChecked():
             self.experimentData.saveIfNeeded()
+        self.experimentData.closeSession()
         self.saveSettings()
         event.accept()
 
@@ -532,11 +778,25 @@ class MainWindow(QWidget):
         settings.setValue("save", self.saveCheckBox.isChecked())
         settings.setValue("port", self.comBox.currentText())
 
-        lhf, hhf, lbf, hbf = self.settingsWidget.getValues()
+        profile = self.settingsWidget.getProfile()
+        settings.setValue("profile", profile.name)
+        settings.setValue("estimator", profile.estimator)
+        settings.setValue("demodulation", profile.demodulation)
+        lhf, hhf, lbf, hbf = profile.bands
         settings.setValue("lhf", lhf)
         settings.setValue("hhf", hhf)
         settings.setValue("lbf", lbf)
         settings.setValue("hbf", hbf)
+        settings.setValue("precision", self.settingsWidget.getPrecision())
+        settings.setValue("framed", isinstance(self.reader.decoder, SyncFrameDecoder))
+        settings.setValue("queuePolicy", self.settingsWidget.getQueuePolicy())
+        settings.setValue("queueSize", self.workQueue.maxSize)
+        settings.setValue("memoryBudget", self.experimentData.memoryBudget // (1024 * 1024))
+        settings.setValue("sound", self.sound)
+        settings.setValue("apneaSeconds", self.eventDetector.apneaSeconds)
+        settings.setValue("bradyRate", self.eventDetector.bradyRate)
+        settings.setValue("tachyRate", self.eventDetector.tachyRate)
+        settings.setValue("lossSeconds", self.eventDetector.lossSeconds)
 
     def loadSettings(self):
         settings = QSettings("rythm_settings.ini",
@@ -554,7 +814,6 @@ class MainWindow(QWidget):
             self.setWindowState(self.windowState() ^ Qt.WindowMaximized)
 
         self.lengthSettingsEdit.setText(settings.value("length", "1"))
-        self.intervalLayoutEdit.setText(settings.value("interval", "10"))
 
         if settings.value("save", True) == "true":
             self.saveCheckBox.setChecked(True)
@@ -564,12 +823,31 @@ class MainWindow(QWidget):
         if itemIndex != -1:
             self.comBox.setCurrentIndex(itemIndex)
 
-        lhf = settings.value("lhf", 0.7)
-        hhf = settings.value("hhf", 2.5)
-        lbf = settings.value("lbf", 0.01)
-        hbf = settings.value("hbf", 0.4)
-
-        self.settingsWidget.setValues(float(lhf), float(hhf), float(lbf), float(hbf))
+        profile = profiles.get(settings.value("profile", "adult"), defaultProfile)
+        lhf = settings.value("lhf", profile.bands[0])
+        hhf = settings.value("hhf", profile.bands[1])
+        lbf = settings.value("lbf", profile.bands[2])
+        hbf = settings.value("hbf", profile.bands[3])
+
+        profile = profile.replace(bands=(float(lhf), float(hhf), float(lbf), float(hbf)),
+                                  window=int(settings.value("interval", profile.window)),
+                                  estimator=settings.value("estimator", profile.estimator),
+                                  demodulation=settings.value("demodulation", profile.demodulation))
+        self.settingsWidget.setProfile(profile)
+        self.intervalLayoutEdit.setText(str(profile.window))
+        self.settingsWidget.setPrecision(settings.value("precision", "float64"))
+        self.reader.setFramed(settings.value("framed", "false") == "true")
+        self.settingsWidget.setQueuePolicy(settings.value("queuePolicy", WorkQueue.DROP_OLDEST))
+        self.workQueue.setPolicy(self.settingsWidget.getQueuePolicy(), int(settings.value("queueSize", 4)))
+
+        self.experimentData.memoryBudget = int(settings.value("memoryBudget", 64)) * 1024 * 1024
+        self.sound = settings.value("sound", "true") == "true"
+        self.eventDetector.apneaSeconds = float(settings.value("apneaSeconds", 20))
+        self.eventDetector.bradyRate = float(settings.value("bradyRate", 50))
+        self.eventDetector.tachyRate = float(settings.value("tachyRate", 120))
+        self.eventDetector.lossSeconds = float(settings.value("lossSeconds", 3))
+        if settings.value("memoryTrace", "false") == "true":
+            start_tracing()
 
 
 app = QApplication([])